@@ -2,19 +2,151 @@
 # Author: Dana Wyman
 #------------------------------------------------------------------------------
 
-from intervaltree import Interval, IntervalTree
 from edge import *
+import numpy as np
 import pdb
 
+class ImplicitIntervalTree(object):
+    """ Static interval index in the style of cgranges' implicit interval
+        tree. Intervals are half-open [start, end) and are kept in flat arrays
+        sorted by start, where the sorted array itself is the in-order layout
+        of a binary tree. Each node also stores the maximum end coordinate of
+        its subtree, which lets overlap queries skip subtrees entirely.
+
+        Intervals added after the tree has been built are held in a small
+        pending list that is scanned linearly, and are merged into the 
+        arrays once the list grows past rebuild_threshold.
+        Attributes:
+            starts, ends, data: Interval starts, ends and payloads, sorted by 
+            start
+            maxes: Maximum end position in the subtree rooted at each node
+            max_level: Level of the root node (-1 if the tree is empty)
+            pending: List of (start, end, data) tuples not yet indexed
+    """
+    rebuild_threshold = 1024
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.data = []
+        self.maxes = []
+        self.max_level = -1
+        self.pending = []
+
+    def __len__(self):
+        return len(self.starts) + len(self.pending)
+
+    def __iter__(self):
+        for interval in zip(self.starts, self.ends, self.data):
+            yield interval
+        for interval in self.pending:
+            yield interval
+
+    def add(self, start, end, data):
+        """ Adds the half-open interval [start, end) with the given payload """
+        self.pending.append((start, end, data))
+        return
+
+    def build(self):
+        """ Merges pending intervals into the sorted arrays and recomputes the
+            subtree maxima, level by level from the leaves up. """
+        if len(self.pending) == 0:
+            return
+
+        starts = np.array(self.starts + [x[0] for x in self.pending], 
+                          dtype = np.int64)
+        ends = np.array(self.ends + [x[1] for x in self.pending], 
+                        dtype = np.int64)
+        data = self.data + [x[2] for x in self.pending]
+        order = np.argsort(starts, kind = "stable")
+        starts = starts[order]
+        ends = ends[order]
+        n = len(starts)
+
+        # Leaves (even indices) take their own end. 'last' tracks the max
+        # value of the rightmost node, which stands in for missing right 
+        # children when the tree is not complete.
+        maxes = ends.copy()
+        last_i = (n - 1) & ~1
+        last = maxes[last_i]
+        k = 1
+        while (1 << k) <= n:
+            x = 1 << (k - 1)
+            nodes = np.arange((x << 1) - 1, n, x << 2)
+            left = maxes[nodes - x]
+            right = np.full(len(nodes), last)
+            has_right = nodes + x < n
+            right[has_right] = maxes[nodes[has_right] + x]
+            maxes[nodes] = np.maximum(ends[nodes], np.maximum(left, right))
+            last_i = last_i - x if (last_i >> k) & 1 else last_i + x
+            if last_i < n and maxes[last_i] > last:
+                last = maxes[last_i]
+            k += 1
+
+        self.starts = starts.tolist()
+        self.ends = ends.tolist()
+        self.data = [data[i] for i in order.tolist()]
+        self.maxes = maxes.tolist()
+        self.max_level = k - 1
+        self.pending = []
+        return
+
+    def overlap(self, start, end):
+        """ Returns the payloads of all intervals overlapping the half-open 
+            query interval [start, end). """
+        if len(self.pending) > self.rebuild_threshold:
+            self.build()
+
+        starts = self.starts
+        ends = self.ends
+        maxes = self.maxes
+        n = len(starts)
+        hits = []
+
+        # Top-down traversal. Each stack entry holds the level and index of a
+        # node, and whether its left subtree has been visited yet.
+        stack = []
+        if self.max_level >= 0:
+            stack.append((self.max_level, (1 << self.max_level) - 1, False))
+        while stack:
+            k, x, left_done = stack.pop()
+            if k <= 3:
+                # Small subtree: scan it directly
+                i0 = x >> k << k
+                i1 = min(i0 + (1 << (k + 1)) - 1, n)
+                for i in range(i0, i1):
+                    if starts[i] >= end: 
+                        break
+                    if start < ends[i]:
+                        hits.append(self.data[i])
+            elif not left_done:
+                # Revisit this node after its left child. The left child
+                # may be out of range when the tree is not complete.
+                y = x - (1 << (k - 1))
+                stack.append((k, x, True))
+                if y >= n or maxes[y] > start:
+                    stack.append((k - 1, y, False))
+            elif x < n and starts[x] < end:
+                if start < ends[x]:
+                    hits.append(self.data[x])
+                stack.append((k - 1, x + (1 << (k - 1)), False))
+
+        for interval_start, interval_end, interval_data in self.pending:
+            if interval_start < end and start < interval_end:
+                hits.append(interval_data)
+        return hits
+
 class EdgeTree(object):
     """ Stores locations of edges as intervals with the goal of querying them 
         for overlap.
         The structure is a dictionary of chromosome names, each mapped to an
-        interval tree. Each interval tree is made up of intervals that map to 
-        corresponding edge ids.
+        implicit interval tree. Each interval tree is made up of intervals 
+        that map to corresponding edge ids. Call build() once the bulk of the
+        edges have been added.
         Attributes:
-            chromosomes: A dictionary mapping chromosome name to an interval 
-            tree containing edges that are located on that chromosome.
+            chromosomes: A dictionary mapping chromosome name to an 
+            ImplicitIntervalTree containing edges that are located on that 
+            chromosome.
             edges: A dictionary mapping edge accession IDs to actual edge 
             objects
             novel: A counter keeping track of the number of novel edges added.
@@ -33,7 +165,13 @@ class EdgeTree(object):
                 chrom_name: Name of the chromosome. This name will be used as 
                 a key to access the interval tree belonging to this chromosome.
         """
-        self.chromosomes[chrom_name] = IntervalTree()
+        self.chromosomes[chrom_name] = ImplicitIntervalTree()
+        return
+
+    def build(self):
+        """ Indexes the edges added so far on every chromosome """
+        for chrom_tree in self.chromosomes.values():
+            chrom_tree.build()
         return
 
     def add_edge(self, edge):
@@ -59,14 +197,14 @@ class EdgeTree(object):
         # Check for collisions. There are two ways a collision can happen.
         # By far the most common case is an edge that is in multiple 
         # transcripts. For this case, merge the edge transcript sets. 
-        # IntervalTrees allow redundancy for intervals with the exact same
-        # positions, so it is OK if two exons from different genes occupy 
-        # identical intervals
+        # The interval trees allow redundancy for intervals with the exact 
+        # same positions, so it is OK if two exons from different genes 
+        # occupy identical intervals
         if edge_id in self.edges:
              oldEdge = self.edges[edge_id]
              edge.transcript_ids = oldEdge.transcript_ids | edge.transcript_ids
         else: 
-            self.chromosomes[chromosome][start:end] = edge_id
+            self.chromosomes[chromosome].add(start, end, edge_id)
     
         self.edges[edge_id] = edge
         return
@@ -127,12 +265,11 @@ class EdgeTree(object):
         # upper limit
         end += 1
  
-        overlapping_edge_intervals  = self.chromosomes[chromosome][start:end]
+        overlapping_edge_ids = self.chromosomes[chromosome].overlap(start, end)
 
         # Only report edges on the same strand as the query
         overlapping_edges = []
-        for interval in overlapping_edge_intervals:
-            edge_id = interval.data
+        for edge_id in overlapping_edge_ids:
             edge = self.edges[edge_id]
             if edge.strand == strand:
                 overlapping_edges.append(edge)
@@ -144,7 +281,7 @@ class EdgeTree(object):
         # TODO: It would be nice if it printed the chromosomes in order 
         for chrom in self.chromosomes:
             print(chrom + ":")
-            for edge_interval in self.chromosomes[chrom]:
-                print("\t" + str(edge_interval))
+            for start, end, edge_id in self.chromosomes[chrom]:
+                print("\t" + str(start) + "-" + str(end) + ": " + edge_id)
         return               
 
@@ -27,7 +27,7 @@ class SamTranscript(Transcript):
     """
 
     def __init__(self, sam_id, chromosome, start, end, strand, introns,
-                 samFields, dataset):
+                 sam_line, dataset):
         self.identifier = str(sam_id)
         self.chromosome = str(chromosome)
         self.start = int(start)
@@ -35,7 +35,7 @@ class SamTranscript(Transcript):
         self.strand = strand
         self.intron_coords = introns
 
-        self.samFields = samFields
+        self.sam_line = sam_line
         self.dataset = dataset
 
         self.name = None
@@ -99,45 +99,45 @@ class SamTranscript(Transcript):
         return
              
 
-def get_sam_transcript(samFields, dataset):
+def get_sam_transcript(sam_record, dataset):
     """ Creates a SamTranscript object from a SAM entry.
         
         Args:
-            samFields: List containing fields from a sam entry.
+            sam_record: pysam AlignedSegment representing the sam entry
             dataset: Name of the dataset that the sam entry comes from
         Returns:
             A SamTranscript object
     """
-    sam_id = samFields[0]
-    flag = int(samFields[1])
-    chromosome = samFields[2]
-    start = int(samFields[3])
+    sam_id = sam_record.query_name
+    flag = sam_record.flag
+    chromosome = sam_record.reference_name
+    start = sam_record.reference_start + 1
 
-    cigar = samFields[5]
-    seq = samFields[9]
-    otherFields = samFields[11:len(samFields)]
+    cigar = sam_record.cigarstring
 
     end = compute_transcript_end(start, cigar)
-    introns = get_introns(otherFields, start, cigar)
+    introns = get_introns(sam_record, start, cigar)
 
     if flag in [16, 272]:
         strand = "-"
     else:
         strand = "+" 
+    # Keep the entry as SAM text: unlike the pysam record it can be pickled,
+    # which lets SAM files be read by worker processes
     sam = SamTranscript(sam_id, chromosome, start, end, strand, introns, 
-                        samFields, dataset)
+                        sam_record.to_string(), dataset)
     return sam
 
 
-def get_introns(fields, start, cigar):
-    """ Locates the jI field in a list of SAM fields or computes
+def get_introns(sam_record, start, cigar):
+    """ Locates the jI tag of a SAM record or computes
         it from the CIGAR string and start position if it isn't found. 
    
         Example jI strings:
             no introns: jI:B:i,-1
             two introns: jI:B:i,167936516,167951806,167951862,167966628
         Args:
-            fields: List containing fields from a sam entry.
+            sam_record: pysam AlignedSegment representing the sam entry
             start: The start position of the transcript with respect to the
             forward strand
             cigar: SAM CIGAR string describing match operations to the reference
@@ -145,16 +145,12 @@ def get_introns(fields, start, cigar):
         Returns:
             intron_list: intron starts and ends in a list (sorted order)
     """
-    indices = [i for i, s in enumerate(fields) if 'jI:B:i' in s]
-
-    if len(indices) == 1:
-        jI = fields[indices[0]]
-    elif len(indices) == 0:
+    try:
+        intron_list = sam_record.get_tag("jI").tolist()
+    except KeyError:
         jI = compute_jI(start, cigar)
-    else:
-        raise ValueError('SAM entry contains more than one jI:B:i field')
+        intron_list = [int(x) for x in jI.split(",")[1:]]
 
-    intron_list = [int(x) for x in jI.split(",")[1:]]
     if intron_list[0] == -1:
         return []
     else:
@@ -9,9 +9,14 @@ import edge as Edge
 import edgetree as EdgeTree
 import gene as Gene
 import genetree as GeneTree
+from collections import Counter, defaultdict
+import csv
 from intervaltree import *
+from itertools import cycle
 from optparse import OptionParser
+import multiprocessing as mp
 import pdb
+import pysam
 import sam_transcript as SamTranscript
 import sqlite3
 import transcript as Transcript
@@ -19,6 +24,49 @@ import transcript_match_tracker as TMT
 import vertex as Vertex
 import warnings
 
+# Statements used when adding novel entries to the database
+INSERT_GENE = 'INSERT INTO "genes" ("gene_id") VALUES (?)'
+INSERT_GENE_ANNOT = """INSERT INTO "gene_annotations" ("ID", "annot_name",
+                       "source", "attribute", "value") VALUES (?,?,?,?,?)"""
+INSERT_TRANSCRIPT = """INSERT INTO "transcripts" ("transcript_id", "gene_id",
+                       "path", "start_vertex", "end_vertex", "n_exons")
+                       VALUES (?,?,?,?,?,?)"""
+INSERT_TRANSCRIPT_ANNOT = """INSERT INTO "transcript_annotations" ("ID",
+                             "annot_name", "source", "attribute", "value")
+                             VALUES (?,?,?,?,?)"""
+INSERT_EDGE = """INSERT INTO "edge" ("edge_ID", "v1", "v2", "edge_type")
+                 VALUES (?,?,?,?)"""
+INSERT_EXON_ANNOT = """INSERT INTO "exon_annotations" ("ID", "annot_name",
+                       "source", "attribute", "value") VALUES (?,?,?,?,?)"""
+INSERT_VERTEX = 'INSERT INTO "vertex" ("vertex_ID", "gene_id") VALUES (?,?)'
+INSERT_LOCATION = """INSERT INTO "location" ("location_id", "genome_build",
+                     "chromosome", "position", "strand") VALUES (?,?,?,?,?)"""
+INSERT_OBSERVED = """INSERT INTO "observed" ("obs_ID", "gene_ID",
+                     "transcript_ID", "read_name", "dataset",
+                     "start_vertex_ID", "end_vertex_ID", "start_delta",
+                     "end_delta", "read_length")
+                     VALUES (?,?,?,?,?,?,?,?,?,?)"""
+INSERT_DATASET = """INSERT INTO "dataset" ("dataset_ID", "dataset_name",
+                    "sample", "platform") VALUES (?,?,?,?)"""
+INSERT_ABUNDANCE = """INSERT INTO "abundance" ("transcript_id", "dataset",
+                      "count") VALUES (?,?,?)"""
+UPDATE_COUNTER = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
+
+# Annotation lookups used when writing outputs, keyed by category
+ANNOT_NAME_QUERIES = {
+    "gene": "SELECT ID, value FROM gene_annotations WHERE attribute = ?",
+    "transcript": """SELECT ID, value FROM transcript_annotations 
+                     WHERE attribute = ?"""}
+ANNOT_STATUS_QUERIES = {
+    "gene": """SELECT ID, source, value FROM gene_annotations 
+               WHERE attribute = ? 
+               ORDER BY CASE value WHEN 'KNOWN' THEN 0 ELSE 1 END,
+                        CASE value WHEN 'KNOWN' THEN rowid ELSE -rowid END""",
+    "transcript": """SELECT ID, source, value FROM transcript_annotations 
+                     WHERE attribute = ? 
+                     ORDER BY CASE value WHEN 'KNOWN' THEN 0 ELSE 1 END,
+                              CASE value WHEN 'KNOWN' THEN rowid ELSE -rowid END"""}
+
 def getOptions():
     parser = OptionParser()
     parser.add_option("--f", dest = "config_file", 
@@ -45,19 +93,30 @@ def getOptions():
     parser.add_option("--min_length", "-l", dest = "min_length",
         help = "Minimum transcript length to use a SAM entry. Default = 300 basepairs",
         type = "string", default = 300)
+    parser.add_option("--threads", "-t", dest = "threads",
+        help = "Number of SAM files to read in parallel. Default = 1",
+        type = "string", default = 1)
     
     (options, args) = parser.parse_args()
     return options
 
-def read_annotation(annot, genome_build):
+def open_database(database):
+    """ Opens the TALON database connection that is shared by every stage of 
+        the run. Transactions are managed explicitly (see update_database).
+    """
+    conn = sqlite3.connect(database, isolation_level=None, 
+                           cached_statements=256)
+    set_connection_pragmas(conn)
+    return conn
+
+def read_annotation(conn, genome_build):
     """ Imports data from the provided TALON database into gene, transcript, and
         exon objects. Also imports the number of novel discoveries from the 
         database so as to properly name discoveries in this run.
     """
 
-    conn = sqlite3.connect(annot)
-    conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
 
     # Get counters
     counter = get_counters(cursor)
@@ -73,28 +132,48 @@ def read_annotation(annot, genome_build):
      
     # Read in transcripts and edges
     transcripts = read_transcripts(cursor, exon_tree, intron_tree)
-
-    conn.close()
+    cursor.close()
     
     return gene_tree, transcripts, exon_tree, intron_tree, vertices, counter
 
+def set_connection_pragmas(conn):
+    """ Tunes the sqlite connection for the large reads that TALON performs:
+        a ~200 MB page cache, in-memory temporary tables, and memory-mapped
+        I/O. These settings only last as long as the connection and leave
+        the database file itself untouched.
+    """
+    conn.execute("PRAGMA cache_size=-200000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return
+
+def add_lookup_indexes(cursor):
+    """ Creates (if absent) the indexes used by the genome build and edge type
+        filters in the read_* queries. Called from update_database, so that
+        runs which do not update the database leave it untouched.
+    """
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_loc_build
+                      ON location(genome_build, location_ID)""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_edge_type
+                      ON edge(edge_type, v1)""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_vertex_gene
+                      ON vertex(gene_ID)""")
+    return
+
 def get_counters(cursor):
     """ Fetches counters for the different database categories and returns
         them in a dictionary """
 
+    # Database category names differ from the keys used in the counter dict
+    key_names = {"genes": "genes", "transcripts": "transcripts", 
+                 "vertex": "vertices", "edge": "edges", "dataset": "datasets",
+                 "observed": "observed"}
+
     counter = {}
-    cursor.execute('SELECT "count" FROM "counters" WHERE "category" = "genes"')
-    counter["genes"] = int(cursor.fetchone()[0])
-    cursor.execute('SELECT "count" FROM "counters" WHERE "category" = "transcripts"')
-    counter["transcripts"] = int(cursor.fetchone()[0])
-    cursor.execute('SELECT "count" FROM "counters" WHERE "category" = "vertex"')
-    counter["vertices"] = int(cursor.fetchone()[0])
-    cursor.execute('SELECT "count" FROM "counters" WHERE "category" = "edge"')
-    counter["edges"] = int(cursor.fetchone()[0])
-    cursor.execute('SELECT "count" FROM "counters" WHERE "category" = "dataset"')
-    counter["datasets"] = int(cursor.fetchone()[0])
-    cursor.execute('SELECT "count" FROM "counters" WHERE "category" = "observed"')
-    counter["observed"] = int(cursor.fetchone()[0])
+    cursor.execute('SELECT "category", "count" FROM "counters"')
+    for category, count in cursor:
+        if category in key_names:
+            counter[key_names[category]] = int(count)
 
     return counter
 
@@ -102,61 +181,53 @@ def read_genes(cursor, build):
     """ Fetches genes from database, creates Gene objects for each, and adds
         them to a GeneTree data structure"""
     gene_tree = GeneTree.GeneTree()
-    query_starts = """SELECT gene_ID, chromosome,MIN(position),strand FROM 
-                   (SELECT * from genes 
+    query = """SELECT gene_ID, chromosome, MIN(position), MAX(position), strand 
+               FROM (SELECT * from genes 
                         LEFT JOIN vertex ON genes.gene_ID = vertex.gene_ID 
-                   ) AS SUBQUERY_START_PLUS
-                    LEFT JOIN location ON SUBQUERY_START_PLUS.vertex_ID = location.location_ID 
-                        WHERE genome_build = """ + str_wrap_double(build) + \
-                        """  GROUP BY gene_ID; """ 
-    query_ends = """SELECT gene_ID, chromosome,MAX(position),strand FROM
-                   (SELECT * from genes
-                        LEFT JOIN vertex ON genes.gene_ID = vertex.gene_ID
-                   ) AS SUBQUERY_START_PLUS
-                    LEFT JOIN location ON SUBQUERY_START_PLUS.vertex_ID = location.location_ID
-                        WHERE genome_build = """ + str_wrap_double(build) + \
-                        """  GROUP BY gene_ID; """
-
-    cursor.execute(query_starts)
-    starts = cursor.fetchall()
-    cursor.execute(query_ends)
-    ends = cursor.fetchall()
-
-    for start, end in zip(starts, ends):
-        gene = Gene.get_gene_from_db(start, end)
+                    ) AS SUBQUERY_GENE_VERTICES
+                    LEFT JOIN location ON SUBQUERY_GENE_VERTICES.vertex_ID = location.location_ID 
+                        WHERE genome_build = ? GROUP BY gene_ID; """ 
+
+    # Plain tuples unpack faster than sqlite3.Row lookups by name
+    row_factory = cursor.row_factory
+    cursor.row_factory = None
+    cursor.execute(query, (build,))
+    for gene_row in cursor:
+        gene = Gene.get_gene_from_db(gene_row)
         gene_tree.add_gene(gene)
+    cursor.row_factory = row_factory
     return gene_tree
 
 def read_vertices(cursor, build):
     """ Extracts vertices and their positions in the provided genome build from 
         the database and organizes them in the following data structure:
     
-        chromosome -> location -> list of vertices (tuples)
+        chromosome -> ChromVertices (position-sorted arrays of vertex IDs,
+                      gene IDs and strands that can be indexed by location
+                      to get a list of vertices)
 
         Note: Vertex and gene IDs are integers here
     """
     
-    vertex_dict = {}
+    # Gather the columns of each chromosome before building its arrays
+    columns = defaultdict(lambda: ([], [], [], []))
     query = """SELECT vertex_ID, chromosome, position, strand, gene_ID FROM
             vertex LEFT JOIN location ON vertex.vertex_id = location.location_ID
-                  WHERE genome_build = """ + str_wrap_double(build) 
-    cursor.execute(query)
-    db_vertices = cursor.fetchall()
- 
-    for v in db_vertices:
-        curr_chrom = v['chromosome']
-        # Add new chromosome if necessary
-        if curr_chrom not in vertex_dict:
-            vertex_dict[curr_chrom] = {}
-
-        # Add location
-        pos = int(v['position'])
-        new_vertex = Vertex.Vertex(v["vertex_ID"], curr_chrom, pos, 
-                                   v["strand"], v["gene_ID"])
-        if pos in vertex_dict[curr_chrom]:
-            vertex_dict[curr_chrom][pos].append(new_vertex)
-        else:
-            vertex_dict[curr_chrom][pos] = [new_vertex]
+                  WHERE genome_build = ?"""
+    row_factory = cursor.row_factory
+    cursor.row_factory = None
+    cursor.execute(query, (build,))
+    for vertex_ID, chromosome, position, strand, gene_ID in cursor:
+        positions, vertex_ids, gene_ids, strands = columns[chromosome]
+        positions.append(position)
+        vertex_ids.append(vertex_ID)
+        gene_ids.append(gene_ID)
+        strands.append(strand)
+    cursor.row_factory = row_factory
+
+    vertex_dict = {}
+    for chrom, chrom_columns in columns.items():
+        vertex_dict[chrom] = Vertex.ChromVertices(chrom, *chrom_columns)
     return vertex_dict
 
 def read_edges(cursor, build, edge_type):
@@ -166,31 +237,27 @@ def read_edges(cursor, build, edge_type):
 
     edge_tree = EdgeTree.EdgeTree()
 
-    # Get all Vertex1 locations
-    v1_query = """SELECT edge_ID, vertex_ID, chromosome, position, strand, gene_id FROM
-                  (SELECT edge_ID,v1,chromosome,position,strand FROM edge
-                   LEFT JOIN location ON edge.v1 = location.location_ID
-                  WHERE genome_build = """ + str_wrap_double(build) + \
-                  """ AND edge_type = """ + str_wrap_double(edge_type) + """) AS SUBQ
-                  LEFT JOIN vertex ON SUBQ.v1 = vertex.vertex_ID;"""
-    # get all Vertex2 locations
-    v2_query = """SELECT edge_ID, vertex_ID, chromosome, position, strand, gene_id FROM
-                  (SELECT edge_ID,v2,chromosome,position,strand FROM edge
-                   LEFT JOIN location ON edge.v2 = location.location_ID
-                  WHERE genome_build = """ + str_wrap_double(build) + \
-                  """ AND edge_type = """ + str_wrap_double(edge_type) + """) AS SUBQ
-                  LEFT JOIN vertex ON SUBQ.v2 = vertex.vertex_ID;"""
-
-    cursor.execute(v1_query)
-    v1s = cursor.fetchall()
-    cursor.execute(v2_query)
-    v2s = cursor.fetchall()
-
-    for v1, v2 in zip(v1s, v2s):
-        edge = Edge.get_edge_from_db(v1, v2)
+    # Get both vertex locations of each edge in a single pass
+    query = """SELECT e.edge_ID, l1.chromosome, l1.position AS v1_position,
+                      l2.position AS v2_position, l1.strand, e.v1, e.v2,
+                      vx.gene_ID
+               FROM edge e
+               JOIN location l1 ON e.v1 = l1.location_ID
+               JOIN location l2 ON e.v2 = l2.location_ID
+                                AND l2.genome_build = l1.genome_build
+               LEFT JOIN vertex vx ON e.v1 = vx.vertex_ID
+               WHERE l1.genome_build = ? AND e.edge_type = ?;"""
+
+    row_factory = cursor.row_factory
+    cursor.row_factory = None
+    cursor.execute(query, (build, edge_type))
+    for edge_row in cursor:
+        edge = Edge.get_edge_from_db(edge_row)
         if not (edge.start == edge.end):
             edge_tree.add_edge(edge)
+    cursor.row_factory = row_factory
 
+    edge_tree.build()
     return edge_tree
 
 
@@ -201,24 +268,22 @@ def read_transcripts(cursor, exon_tree, intron_tree):
     transcripts = {}
 
     cursor.execute('SELECT * FROM transcripts')
-    transcript_rows = cursor.fetchall()
-    for t in transcript_rows:
+    for t in cursor:
+        # Transcripts whose edges are missing from the trees are reported and
+        # skipped (KeyError from the strand lookup, RuntimeError otherwise)
         try:
             transcript = Transcript.get_transcript_from_db(t, exon_tree, intron_tree)
-            if transcript != None:
-                transcripts[transcript.identifier] = transcript
-        except Exception as e:
+        except (KeyError, RuntimeError) as e:
             print(e)
+            continue
+        if transcript != None:
+            transcripts[transcript.identifier] = transcript
 
     return transcripts
 
-def str_wrap_double(string):
-    """ Adds double quotes around the input string """
-    return '"' + string + '"'
-
 def process_sam_file(sam_file, dataset, min_coverage, min_identity, min_length, 
                      logfile):
-    """ Reads transcripts from a SAM file
+    """ Reads transcripts from a SAM file (BAM files are also accepted)
         Args:
             sam_file: Path to the SAM file
         Returns:
@@ -227,80 +292,82 @@ def process_sam_file(sam_file, dataset, min_coverage, min_identity, min_length,
 
     sam_transcripts = []
 
-    o = open(logfile, 'a')
+    # Line buffered so that workers reading other SAM files in parallel
+    # append whole lines to the shared log
+    o = open(logfile, 'a', buffering = 1)
 
-    with open(sam_file) as sam:
-        for line in sam:
-            line = line.strip()
+    with pysam.AlignmentFile(sam_file) as sam:
+        for record in sam:
 
-            # Ignore header
-            if line.startswith("@"):
-                continue
-
-            sam = line.split("\t")
-
-            # Only use uniquely mapped transcripts for now
-            if sam[1] not in ["0", "16"]:
+            # Only use uniquely mapped transcripts for now. This also excludes
+            # unmapped, secondary, and supplementary alignments
+            if record.flag not in [0, 16]:
                 continue
 
             # Only use reads that are >= 300 bp long
-            if len(sam[9]) < min_length:
+            if record.query_length < min_length:
                 continue
 
-            # Locate the MD field of the sam transcript
+            # Locate the NM field of the sam transcript
             try:
-                md_index = [i for i, s in enumerate(sam) if s.startswith('MD:Z:')][0]
-            except:
-                raise ValueError("SAM transcript " + sam[0] + " lacks the MD flag")
+                n_edits = record.get_tag("NM")
+            except KeyError:
+                raise ValueError("SAM transcript " + record.query_name + \
+                                 " lacks the NM flag")
 
             # Only use reads where alignment coverage and identity exceed 
             # cutoffs
-            coverage = compute_alignment_coverage(sam[5])
-            identity = compute_alignment_identity(sam[md_index], sam[9])
+            cigar_stats = record.get_cigar_stats()[0]
+            coverage = compute_alignment_coverage(cigar_stats)
+            identity = compute_alignment_identity(cigar_stats, n_edits,
+                                                  record.query_length)
 
             if coverage < min_coverage or identity < min_identity:
-                outstr = "\t".join([dataset, sam[0], str(coverage), str(identity)])
+                outstr = "\t".join([dataset, record.query_name, str(coverage),
+                                    str(identity)])
                 o.write(outstr + "\n")
                 continue
 
+            # Malformed transcripts (e.g. inconsistent exon coordinates) 
+            # raise ValueError and are skipped; anything else is a bug
             try: 
-                sam_transcript = SamTranscript.get_sam_transcript(sam, dataset)
-                sam_transcripts.append(sam_transcript)
-            except:
+                sam_transcript = SamTranscript.get_sam_transcript(record, 
+                                                                  dataset)
+            except ValueError as e:
                 print("An error occurred while processing sam transcript " + \
-                      sam[0] + ". Will skip this transcript.")
+                      record.query_name + " (" + str(e) + \
+                      "). Will skip this transcript.")
+                continue
+            sam_transcripts.append(sam_transcript)
         o.close() 
 
     return sam_transcripts
 
-def compute_alignment_coverage(CIGAR):
+def compute_alignment_coverage(cigar_stats):
     """ This function computes what fraction of the read is actually aligned to
-        the genome by excluding hard or soft-clipped bases."""
+        the genome by excluding hard or soft-clipped bases. cigar_stats holds
+        the per-operation base counts from pysam's get_cigar_stats()."""
 
-    total_bases = 0.0
-    unaligned_bases = 0.0   
-    ops, counts = SamTranscript.split_cigar(CIGAR)
-    for op,ct in zip(ops, counts):
-        if op == "H" or op == "S":
-            unaligned_bases += ct
-        total_bases += ct
+    # The final entry of cigar_stats is the NM tag rather than an operation
+    total_bases = float(sum(cigar_stats[:10]))
+    unaligned_bases = cigar_stats[pysam.CSOFT_CLIP] + \
+                      cigar_stats[pysam.CHARD_CLIP]
 
     return (total_bases - unaligned_bases)/total_bases
    
-def compute_alignment_identity(MD_tag, SEQ):
+def compute_alignment_identity(cigar_stats, n_edits, read_length):
     """ This function computes what fraction of the read matches the reference
-        genome."""
-    
-    total_bases = len(SEQ)
-    matches = 0.0
-    ops, counts = SamTranscript.splitMD(MD_tag)
-    for op,ct in zip(ops, counts):
-        if op == "M":
-            matches += ct
-        if op == "D":
-            total_bases += ct
-
-    return matches/total_bases 
+        genome. The NM tag (n_edits) counts mismatches, inserted bases, and
+        deleted bases, so the mismatches are what remains after removing the
+        indels reported in cigar_stats."""
+
+    insertions = cigar_stats[pysam.CINS]
+    deletions = cigar_stats[pysam.CDEL]
+    aligned = cigar_stats[pysam.CMATCH] + cigar_stats[pysam.CEQUAL] + \
+              cigar_stats[pysam.CDIFF]
+    matches = aligned - (n_edits - insertions - deletions)
+
+    return float(matches)/(read_length + deletions)
     
 
 def identify_sam_transcripts(sam_transcripts, gene_tree, transcripts, exon_tree, 
@@ -310,8 +377,8 @@ def identify_sam_transcripts(sam_transcripts, gene_tree, transcripts, exon_tree,
         Returns:
             Modified versions of gene_tree, transcripts, exon_tree, counter to
                 which novel objects have been added
-            abundance_dict: dictionary mapping transcript IDs to the number of 
-                times each was observed in the sam data 
+            abundance_dict: defaultdict(Counter) mapping transcript IDs to 
+                the number of times each was observed in each dataset
     """
 
     for sam_transcript in sam_transcripts:
@@ -385,14 +452,7 @@ def identify_sam_transcripts(sam_transcripts, gene_tree, transcripts, exon_tree,
                                        vertices, dataset, counter, novel_ids)    
 
         # Add transcript observation to abundance dict
-        if annot_transcript.identifier in abundance:
-            try:
-                abundance[annot_transcript.identifier][dataset] += 1
-            except:
-                abundance[annot_transcript.identifier][dataset] = 1
-        else:
-            abundance[annot_transcript.identifier] = {}
-            abundance[annot_transcript.identifier][dataset] = 1
+        abundance[annot_transcript.identifier][dataset] += 1
             
     return
 
@@ -401,7 +461,7 @@ def get_transcript_start_and_end_diffs(sam_transcript, annot_transcript,
     """Must already have a completed match for the query transcript"""
 
     # Get IDs
-    obs_id = str(counter["observed"] + 1)
+    obs_id = counter["observed"] + 1
     counter["observed"] += 1
 
     # Get the 5' and 3' difference between the sam transcript and the 
@@ -461,21 +521,16 @@ def make_novel_transcript(sam_transcript, transcripts, edge_matches, exon_tree,
     # First, get edges in the novel transcript
     novel_transcript_exons = []
     novel_transcript_introns = []
-    i = 0
-    for sam_edge, edge_match in zip(sam_transcript.get_all_edges(), edge_matches):
+
+    # Edges alternate exon, intron, exon, ..., so pair each one with the
+    # matching tree, type and output list rather than branching on its index
+    edge_kinds = cycle(((exon_tree, "exon", novel_transcript_exons),
+                        (intron_tree, "intron", novel_transcript_introns)))
+    for sam_edge, edge_match, (edge_tree, edge_type, novel_list) in \
+            zip(sam_transcript.get_all_edges(), edge_matches, edge_kinds):
         edge_start = sam_edge.start
         edge_end = sam_edge.end
 
-        # Even indices are exons
-        if i % 2 == 0:
-            edge_tree = exon_tree
-            edge_type = "exon"
-            novel_list = novel_transcript_exons
-        else:
-            edge_tree = intron_tree
-            edge_type = "intron"
-            novel_list = novel_transcript_introns
-
         # To ensure that all edges in a transcript come from the same gene,
         # it is necessary to create a new edge if the match comes from a 
         # different gene
@@ -506,7 +561,6 @@ def make_novel_transcript(sam_transcript, transcripts, edge_matches, exon_tree,
  
         # Add edge to intron or exon list.
         novel_list.append(edge_obj)
-        i += 1
 
     start = novel_transcript_exons[0].start
     end = novel_transcript_exons[-1].end
@@ -561,45 +615,55 @@ def find_transcript_match(query_transcript, transcripts, exon_tree, intron_tree)
     return transcript_match, match_type, edge_matches, diff
         
 
-def update_database(database, datasets, transcripts, counter, novel_ids, 
-                    abundances, batch_size, genome_build):
-    """ Add novel entries to the supplied database
+def update_database(conn, datasets, transcripts, counter, novel_ids, 
+                    abundances, genome_build):
+    """ Add novel entries to the supplied database. All of the inserts are made
+        in a single transaction, which is rolled back if any of them fail or
+        if the integrity check does not pass.
     """
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
+    # The connection is in autocommit mode, so the transaction is opened 
+    # explicitly with BEGIN IMMEDIATE. The whole update is a single
+    # transaction, so it is enough to sync at its commit
     cursor = conn.cursor()
+    cursor.execute("PRAGMA synchronous=NORMAL")
 
-    n_genes = str(len(novel_ids["genes"]))
-    n_transcripts = str(len(novel_ids["transcripts"]))
+    with conn:
+        cursor.execute("BEGIN IMMEDIATE")
 
-    print("Adding " + n_genes + " novel genes to database...")
-    batch_add_genes(cursor, novel_ids, batch_size)
+        n_genes = str(len(novel_ids["genes"]))
+        n_transcripts = str(len(novel_ids["transcripts"]))
+
+        print("Adding " + n_genes + " novel genes to database...")
+        batch_add_genes(cursor, novel_ids)
         
-    print("Adding " + n_transcripts + " novel transcripts to database...")
-    batch_add_transcripts(cursor, novel_ids, batch_size)
+        print("Adding " + n_transcripts + " novel transcripts to database...")
+        batch_add_transcripts(cursor, novel_ids)
 
-    print("Adding edges and vertices to database............")
-    batch_add_edges(cursor, novel_ids, batch_size)
-    batch_add_vertices_and_locations(cursor, novel_ids, genome_build, batch_size)
+        print("Adding edges and vertices to database............")
+        batch_add_edges(cursor, novel_ids)
+        batch_add_vertices_and_locations(cursor, novel_ids, genome_build)
 
-    print("Adding observed starts and ends to database............")
-    batch_add_observed(cursor, novel_ids, batch_size)
+        print("Adding observed starts and ends to database............")
+        batch_add_observed(cursor, novel_ids)
 
-    print("Adding datasets to database............")
-    add_datasets(cursor, novel_ids, counter)
+        print("Adding datasets to database............")
+        add_datasets(cursor, novel_ids, counter)
 
-    print("Updating counter.............")
-    update_counter(cursor, counter)
+        print("Updating counter.............")
+        update_counter(cursor, counter)
 
-    # Update abundance table
-    batch_add_abundance(cursor, abundances, batch_size)
+        # Update abundance table
+        batch_add_abundance(cursor, abundances)
 
-    # Before actually committing the changes to the database, perform a 
-    # set of validity checks as a safeguard
-    check_database_integrity(cursor)
+        # Before actually committing the changes to the database, perform a 
+        # set of validity checks as a safeguard
+        check_database_integrity(cursor)
 
-    conn.commit()
-    conn.close() 
+    # Make sure the lookup indexes exist for the next run's reads, and refresh
+    # the query planner statistics now that the ingest is done
+    add_lookup_indexes(cursor)
+    cursor.execute("ANALYZE")
+    cursor.close()
     return
 
 def check_database_integrity(cursor):
@@ -611,11 +675,15 @@ def check_database_integrity(cursor):
     cursor.execute(counter_query)
     counters = cursor.fetchall()
 
+    # Count the rows of every table in a single query
+    query = " UNION ALL ".join(['SELECT ?, COUNT(*) FROM "' + table_name + '"'
+                                for table_name, curr_counter in counters])
+    cursor.execute(query, [table_name for table_name, curr_counter in counters])
+    table_counts = dict(cursor.fetchall())
+
     for table_name, curr_counter in counters:
         curr_counter = int(curr_counter)
-        query = "select COUNT(*) from " + table_name
-        cursor.execute(query)
-        actual_count = int(cursor.fetchone()[0])
+        actual_count = int(table_counts[table_name])
 
         if actual_count != curr_counter:
             print("table_count: "  + str(actual_count))
@@ -627,261 +695,72 @@ def check_database_integrity(cursor):
     return
 
 def update_counter(cursor, counter):
-    # Update the database counter
-    update_g = 'UPDATE "counters" SET "count" = ? WHERE "category" = "genes"'
-    cursor.execute(update_g,[counter['genes']])
-
-    update_t = 'UPDATE "counters" SET "count" = ? WHERE "category" = "transcripts"'
-    cursor.execute(update_t,[counter['transcripts']])
-
-    update_e = 'UPDATE "counters" SET "count" = ? WHERE "category" = "edge"'
-    cursor.execute(update_e,[counter['edges']])
-
-    update_v = 'UPDATE "counters" SET "count" = ? WHERE "category" = "vertex"'
-    cursor.execute(update_v,[counter['vertices']])
-
-    update_d = 'UPDATE "counters" SET "count" = ? WHERE "category" = "dataset"'
-    cursor.execute(update_d,[counter['datasets']])
-
-    update_o = 'UPDATE "counters" SET "count" = ? WHERE "category" = "observed"'
-    cursor.execute(update_o,[counter['observed']])
-
+    """ Update the database counters. Note that the category names in the 
+        database differ from the keys of the counter dict for some items """
+    pairs = [(counter['genes'], 'genes'),
+             (counter['transcripts'], 'transcripts'),
+             (counter['edges'], 'edge'),
+             (counter['vertices'], 'vertex'),
+             (counter['datasets'], 'dataset'),
+             (counter['observed'], 'observed')]
+    cursor.executemany(UPDATE_COUNTER, pairs)
     return
 
-def batch_add_genes(cursor, novel_ids, batch_size):
-
-    novel_tuples = list(novel_ids['genes'].values())
-    gene_entries = []
-    gene_annotations = []
-    for nt in novel_tuples:
-        gene_entries.append((nt[0],))
-        gene_annotations.append((nt[0], "talon_run", nt[-1],
-                                       "gene_status", "NOVEL"))
-
-    index = 0
-    while index < len(gene_entries):
-        try:
-            gene_batch = gene_entries[index:index + batch_size]
-            annot_batch = gene_annotations[index:index + batch_size]
-        except:
-            gene_batch = gene_entries[index:]
-            annot_batch = gene_annotations[index:]
-        index += batch_size
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in 
-                   ["gene_id"]]) + ") "
-            command = 'INSERT INTO "genes"' + cols + "VALUES " + '(?)'
-            cursor.executemany(command, gene_batch)
-        except Exception as e:
-            print(e)
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["ID", "annot_name", "source", "attribute", "value"]]) + ") "
-            command = 'INSERT INTO "gene_annotations"' + cols + "VALUES " + \
-                      '(?,?,?,?,?)'
-            cursor.executemany(command, annot_batch)
-
-        except Exception as e:
-            print(e)
+def batch_add_genes(cursor, novel_ids):
 
+    novel_tuples = novel_ids['genes'].values()
+    cursor.executemany(INSERT_GENE, ((nt[0],) for nt in novel_tuples))
+    cursor.executemany(INSERT_GENE_ANNOT, 
+                       ((nt[0], "talon_run", nt[-1], "gene_status", "NOVEL")
+                        for nt in novel_tuples))
     return
 
-def batch_add_transcripts(cursor, novel_ids, batch_size):
+def batch_add_transcripts(cursor, novel_ids):
 
     # Using the novel IDs, extract transcripts that need to be added
     # and fetch their gene IDs and path (sequence of edges)
 
-    novel_tuples = list(novel_ids['transcripts'].values())
-    transcript_entries = []
-    transcript_annotations = []
-    for nt in novel_tuples:
-        transcript_entries.append(nt[0:6])
-        transcript_annotations.append((nt[0], "talon_run", nt[6], 
-                                       "transcript_status", "NOVEL"))
-    index = 0
-    while index < len(transcript_entries):
-        try:
-            transcript_batch = transcript_entries[index:index + batch_size]
-            annot_batch = transcript_annotations[index:index + batch_size]
-        except:
-            transcript_batch = transcript_entries[index:]
-            annot_batch = transcript_annotations[index:]
-        index += batch_size
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in 
-                   ["transcript_id", "gene_id", "path", "start_vertex",
-                     "end_vertex", "n_exons"]]) +\
-                    ") "
-            command = 'INSERT INTO "transcripts"' + cols + "VALUES " + '(?,?,?,?,?,?)'
-            cursor.executemany(command, transcript_batch)
-        except Exception as e:
-            print(e) 
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["ID", "annot_name", "source", "attribute", "value"]]) + ") "
-            command = 'INSERT INTO "transcript_annotations"' + cols + \
-                      "VALUES " + '(?,?,?,?,?)'
-            cursor.executemany(command, annot_batch)
-
-        except Exception as e:
-            print(e)
-
+    novel_tuples = novel_ids['transcripts'].values()
+    cursor.executemany(INSERT_TRANSCRIPT, (nt[0:6] for nt in novel_tuples))
+    cursor.executemany(INSERT_TRANSCRIPT_ANNOT,
+                       ((nt[0], "talon_run", nt[6], "transcript_status", 
+                         "NOVEL") for nt in novel_tuples))
     return
 
-def batch_add_edges(cursor, novel_ids, batch_size):
-
-    edge_tuples = list(novel_ids['edges'].values())
-    edge_entries = []
-    exon_annotations = []
-
-    for entry in edge_tuples:
-        edge_entries.append(entry[0:4])
-        if entry[-2] == "exon":
-            exon_annotations.append((entry[0], "talon_run", entry[-1],
-                                       "exon_status", "NOVEL"))
-
-    index = 0
-    while index < len(edge_entries):
-        try:
-            batch = edge_entries[index:index + batch_size]
-        except:
-            batch = edge_entries[index:]
-        index += batch_size
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["edge_ID", "v1", "v2", "edge_type"]]) + ") "
-            command = 'INSERT INTO "edge"' + cols + "VALUES " + '(?,?,?,?)'
-            cursor.executemany(command, batch)
-
-        except Exception as e:
-            print(e)
-
-    index = 0
-    while index < len(exon_annotations):
-        try:
-            annot_batch = exon_annotations[index:index + batch_size]
-        except:
-            annot_batch = exon_annotations[index:]
-        index += batch_size
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["ID", "annot_name", "source", "attribute", "value"]]) + ") "
-            command = 'INSERT INTO "exon_annotations"' + cols + \
-                      "VALUES " + '(?,?,?,?,?)'
-            cursor.executemany(command, annot_batch)
-
-        except Exception as e:
-            print(e)
+def batch_add_edges(cursor, novel_ids):
 
+    edge_tuples = novel_ids['edges'].values()
+    cursor.executemany(INSERT_EDGE, (entry[0:4] for entry in edge_tuples))
+    cursor.executemany(INSERT_EXON_ANNOT,
+                       ((entry[0], "talon_run", entry[-1], "exon_status", 
+                         "NOVEL") for entry in edge_tuples 
+                        if entry[-2] == "exon"))
     return
 
-def batch_add_vertices_and_locations(cursor, novel_ids, genome_build, batch_size):
-
-    novel_tuples = list(novel_ids['vertices'].values())
-    vertex_entries = []
-    location_entries = []
-    for nt in novel_tuples:
-        vertex_entries.append(nt[0:2])
-        location_entries.append((nt[0], genome_build, nt[2], nt[3], nt[4]))
-
-    index = 0
-    while index < len(vertex_entries):
-        try:
-            vertex_batch = vertex_entries[index:index + batch_size]
-            location_batch = location_entries[index:index + batch_size]
-        except:
-            vertex_batch = vertex_entries[index:]
-            location_batch = location_entries[index:]
-        index += batch_size
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["vertex_ID", "gene_id"]]) + ") "
-            command = 'INSERT INTO "vertex"' + cols + "VALUES " + '(?,?)'
-            cursor.executemany(command, vertex_batch)
-
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["location_id", "genome_build", "chromosome", "position",
-                    "strand"]]) + ") "
-            command = 'INSERT INTO "location"' + cols + "VALUES " + \
-                      '(?,?,?,?,?)'
-            cursor.executemany(command, location_batch)
-
-        except Exception as e:
-            print(e)
+def batch_add_vertices_and_locations(cursor, novel_ids, genome_build):
 
+    novel_tuples = novel_ids['vertices'].values()
+    cursor.executemany(INSERT_VERTEX, (nt[0:2] for nt in novel_tuples))
+    cursor.executemany(INSERT_LOCATION, 
+                       ((nt[0], genome_build, nt[2], nt[3], nt[4]) 
+                        for nt in novel_tuples))
     return
 
-def batch_add_observed(cursor, novel_ids, batch_size):
-    observed = list(novel_ids['observed'].values())
-    index = 0
-    while index < len(observed):
-        try:
-            batch = observed[index:index + batch_size]
-        except:
-            batch = observed[index:]
-        index += batch_size
-
-        # Add to database
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in
-                   ["obs_ID", "gene_ID", "transcript_ID", "read_name", 
-                    "dataset", "start_vertex_ID", "end_vertex_ID", 
-                    "start_delta", "end_delta", "read_length"]]) + ") "
-            command = 'INSERT INTO "observed"' + cols + \
-                      "VALUES " + '(?,?,?,?,?,?,?,?,?,?)'
-            cursor.executemany(command, batch)
-
-        except Exception as e:
-            print(e)
+def batch_add_observed(cursor, novel_ids):
+    cursor.executemany(INSERT_OBSERVED, novel_ids['observed'].values())
     return
 
 def add_datasets(cursor, novel_ids, counter):
-    datasets = list(novel_ids['datasets'].values())
-
-    try:
-        cols = " (" + ", ".join([str_wrap_double(x) for x in
-               ["dataset_ID", "dataset_name", "sample", "platform"]]) + ") "
-        command = 'INSERT INTO "dataset"' + cols + \
-                  "VALUES " + '(?,?,?,?)'
-        cursor.executemany(command, datasets)
-
-    except Exception as e:
-        print(e)
+    cursor.executemany(INSERT_DATASET, novel_ids['datasets'].values())
     return
         
 
-def batch_add_abundance(cursor, abundance_dict, batch_size):
-
-    abundances = []   
-
-    for transcript_id in list(abundance_dict.keys()):
-        dataset_abundances = abundance_dict[transcript_id]
-        for dataset in list(dataset_abundances.keys()):
-            abundance_tuple = (transcript_id, dataset, dataset_abundances[dataset])
-            abundances.append(abundance_tuple)
+def batch_add_abundance(cursor, abundance_dict):
 
-    index = 0
-    while index < len(abundances):
-        try:
-            batch = abundances[index:index + batch_size]
-        except:
-            batch = abundances[index:]
-        index += batch_size
-
-        try:
-            cols = " (" + ", ".join([str_wrap_double(x) for x in 
-                   ["transcript_id", "dataset", "count"]]) + ") "
-            command = 'INSERT INTO "abundance"' + cols + "VALUES " + '(?,?,?)'
-            cursor.executemany(command, batch)
-        except Exception as e:
-            print(e)
+    abundances = ((transcript_id, dataset, count)
+                  for transcript_id, dataset_abundances in abundance_dict.items()
+                  for dataset, count in dataset_abundances.items())
+    cursor.executemany(INSERT_ABUNDANCE, abundances)
     return
 
 
@@ -890,74 +769,50 @@ def compute_abundances(sam_transcripts, dataset):
         each in a dictionary. This dictionary is then converted to a list of 
         tuples that can later be added to the TALON database"""
    
-    abundance_dict = {}    
-    for sam_transcript in sam_transcripts:
-        transcript_id = sam_transcript.transcript_ID
-        try:
-            abundance_dict[transcript_id] += 1
-        except:
-            abundance_dict[transcript_id] = 1
-
-    abundances = [(x, dataset, abundance_dict[x]) for x in list(abundance_dict.keys())]
+    counts = Counter(t.transcript_ID for t in sam_transcripts)
+    abundances = [(transcript_id, dataset, count) 
+                  for transcript_id, count in counts.items()]
     return abundances
 
-def write_outputs(sam_transcripts, outprefix):
-    """ Create a tab-delimited summary file that lists the gene and transcript
-        assignments of every input transcript. """
+def init_outputs(outprefix):
+    """ Opens the tab-delimited summary file that lists the gene and 
+        transcript assignments of every input transcript, and writes its 
+        header. Returns the open file and a csv writer for it. """
 
     #out_sam = open(outprefix + "_talon.sam", 'w')
-    out_txt = open(outprefix + "_talon.tsv", 'w')
-
-    out_txt.write("\t".join(["dataset", "read_ID", "chromosome", "start", "end",
-                       "strand", "gene_id", "transcript_id",
-                       "annotation_status", "length", "diff_5", "diff_3"]) + "\n") 
-
-    for transcript in sam_transcripts:
-        gene_id = transcript.gene_ID
-        gene_name = "NA"
-        transcript_id = transcript.transcript_ID
-        annotation = transcript.novel
-        chromosome = transcript.chromosome
-        start = str(transcript.start)
-        end = str(transcript.end)
-        strand = transcript.strand
-        length = str(transcript.get_length()) 
-        diff_5 = str(transcript.diff_5)
-        diff_3 = str(transcript.diff_3)
-        dataset = str(transcript.dataset)
-
-        try:
-            out_txt.write("\t".join([dataset, transcript.identifier, \
-                     chromosome, start, end, strand, gene_id, transcript_id, \
-                     annotation, length, diff_5, diff_3]) + "\n") 
-        except Exception as e: 
-            print(e)
-            
-    out_txt.close()
+    out_txt = open(outprefix + "_talon.tsv", 'w', newline = '', 
+                   buffering = 1 << 20)
+    writer = csv.writer(out_txt, delimiter = '\t', lineterminator = '\n')
+    writer.writerow(["dataset", "read_ID", "chromosome", "start", "end",
+                     "strand", "gene_id", "transcript_id",
+                     "annotation_status", "length", "diff_5", "diff_3"])
+    return out_txt, writer
+
+def write_outputs(sam_transcripts, writer):
+    """ Appends the assignments of the provided sam transcripts to the summary
+        file. Called once per dataset, so that each dataset's transcripts can
+        be released once they are written. """
+
+    writer.writerows((str(t.dataset), t.identifier, t.chromosome,
+                      str(t.start), str(t.end), t.strand, t.gene_ID, 
+                      t.transcript_ID, t.novel, str(t.get_length()), 
+                      str(t.diff_5), str(t.diff_3)) 
+                     for t in sam_transcripts)
     return
 
 def get_transcript_info(transcript_ID, gene_ID, gene_status, transcript_status):
     """ Look up annotation info about the provided transcript and gene IDs. 
         If not found, set values to NA """
 
-    try:
-        gene_annotated = gene_status[gene_ID][0]
-        gene_discovery_dataset = gene_status[gene_ID][1]
-    except:
-        gene_annotated = "NA"
-        gene_discovery_dataset = "NA"
-
-    try:
-        transcript_annotated = transcript_status[transcript_ID][0]
-        transcript_discovery_dataset = transcript_status[transcript_ID][1]
-    except:
-        transcript_annotated = "NA"
-        transcript_discovery_dataset = "NA"
+    gene_annotated, gene_discovery_dataset = \
+        gene_status.get(gene_ID, ("NA", "NA"))
+    transcript_annotated, transcript_discovery_dataset = \
+        transcript_status.get(transcript_ID, ("NA", "NA"))
 
     return [gene_annotated, gene_discovery_dataset, transcript_annotated, 
             transcript_discovery_dataset]
 
-def get_readable_name_dict(database, cat_type):
+def get_readable_name_dict(conn, cat_type):
     """ Query the provided database and return a dictionary as follows:
             ID of gene or transcript -> [ KNOWN/NOVEL, SOURCE]
         The 'cat_type' variable should be either 'gene' or 'transcript',
@@ -965,22 +820,16 @@ def get_readable_name_dict(database, cat_type):
 
     annotation_names = {}
 
-    conn = sqlite3.connect(database)
     cursor = conn.cursor()
 
-    query = "SELECT * FROM " + cat_type + "_annotations WHERE attribute = '" + cat_type + "_name'"
-    cursor.execute(query)
-    annot_names = cursor.fetchall()
+    cursor.execute(ANNOT_NAME_QUERIES[cat_type], (cat_type + "_name",))
+    for ID, name in cursor:
+        annotation_names[str(ID)] = name
 
-    for result in annot_names:
-        ID = str(result[0])
-        name = result[-1]
-        annotation_names[ID] = name
-
-    conn.close()
+    cursor.close()
     return annotation_names
 
-def get_annotation_status_dict(database, cat_type):
+def get_annotation_status_dict(conn, cat_type):
     """ Query the provided database and return a dictionary as follows:
             ID of gene or transcript -> [ KNOWN/NOVEL, SOURCE]
         The 'cat_type' variable should be either 'gene' or 'transcript',
@@ -988,31 +837,20 @@ def get_annotation_status_dict(database, cat_type):
 
     annotation_status = {}
 
-    conn = sqlite3.connect(database)
     cursor = conn.cursor()
 
-    query = "SELECT * FROM " + cat_type + "_annotations WHERE attribute = '" + cat_type + "_status'"
-    cursor.execute(query)
-    annot_status = cursor.fetchall()
-   
-    for result in annot_status:
-        ID = str(result[0])
-        annotation = result[-1]
-        source = result[2]
-
-        if ID not in annotation_status:
-            annotation_status[ID] = [annotation, source]
-        else:
-            if annotation_status[ID][0] == "KNOWN":
-                continue
-            else:
-                annotation_status[ID] = [annotation, source]
+    cursor.execute(ANNOT_STATUS_QUERIES[cat_type], (cat_type + "_status",))
+    # The first row seen for an ID wins. Rows are ordered so that this is
+    # the earliest KNOWN row if there is one, and otherwise the most recently
+    # inserted row
+    for ID, source, annotation in cursor:
+        annotation_status.setdefault(str(ID), [annotation, source])
 
-    conn.close()
+    cursor.close()
     return annotation_status  
 
 
-def checkArgs(options):
+def checkArgs(options, conn):
     """ Makes sure that the options specified by the user are compatible with 
         each other """
     
@@ -1024,17 +862,15 @@ def checkArgs(options):
                             "you are running a Python version >= 2.7.13.")
 
     config_file = options.config_file
-    annot = options.annot
     build = options.build
     out = options.outfile
 
     # Make sure that the genome build exists in the provided TALON database.
-    conn = sqlite3.connect(annot)
     cursor = conn.cursor() 
     cursor.execute(""" SELECT DISTINCT name FROM genome_build """)
     annot_builds = cursor.fetchone()
     if build not in annot_builds:
-        build_names = ", ".join(list(annot_builds))
+        build_names = ", ".join(annot_builds)
         raise ValueError("Please specify a genome build that exists in the" + 
                           " database. The choices are: " + build_names)
     annot_builds = cursor.fetchall()
@@ -1067,83 +903,118 @@ def checkArgs(options):
                     raise ValueError('Last field in config file must be a .sam file')
                 sam_files.append(line[3])
 
-    conn.close()
+    cursor.close()
     return sam_files, dataset_metadata
 
 def main():
     options = getOptions()
 
-    # Check validity of input options
-    sam_files, dataset_list = checkArgs(options)
-
-    if len(sam_files) == 0:
-        print("No new SAM files included in input. Exiting...")
-        exit()
-
-    annot = options.annot
-    build = options.build
-    min_coverage = float(options.min_coverage)
-    min_identity = float(options.min_identity)
-    min_length = int(options.min_length)
-    out = options.outfile
+    # A single connection to the TALON database is used for the whole run
+    conn = open_database(options.annot)
 
-    # Process the annotations
-    print("Processing annotation....................")
-    gene_tree, annot_transcripts, exon_tree, intron_tree, vertices, counter \
-                                                 = read_annotation(annot, build)
+    pool = None
+    out_txt = None
+    try:
+        # Check validity of input options
+        sam_files, dataset_list = checkArgs(options, conn)
+
+        if len(sam_files) == 0:
+            print("No new SAM files included in input. Exiting...")
+            exit()
+
+        build = options.build
+        min_coverage = float(options.min_coverage)
+        min_identity = float(options.min_identity)
+        min_length = int(options.min_length)
+        threads = int(options.threads)
+        out = options.outfile
+
+        # Process the annotations
+        print("Processing annotation....................")
+        gene_tree, annot_transcripts, exon_tree, intron_tree, vertices, \
+                                       counter = read_annotation(conn, build)
     
-    # Process the SAM files
-    print("Processing SAM file......................")
-    qc_file = out + "_talon_QC.log"
-    o = open(qc_file, 'w')
-    o.write("# TALON run filtering settings:\n")
-    o.write("# Fraction aligned: " + str(min_coverage) + "\n")
-    o.write("# Min identity to reference: " + str(min_identity) + "\n")
-    o.write("-------------------------------------------\n")
-    o.write("\t".join(["dataset", "read_ID", "fraction_aligned", "identity"]) + "\n")
-    o.close()
-
-    novel_ids = {'datasets': {}, \
-                 'genes': {}, \
-                 'transcripts': {}, \
-                 'edges': {}, \
-                 'vertices': {}, \
-                 'observed': {}}
+        # Process the SAM files
+        print("Processing SAM file......................")
+        qc_file = out + "_talon_QC.log"
+        o = open(qc_file, 'w')
+        o.write("# TALON run filtering settings:\n")
+        o.write("# Fraction aligned: " + str(min_coverage) + "\n")
+        o.write("# Min identity to reference: " + str(min_identity) + "\n")
+        o.write("-------------------------------------------\n")
+        o.write("\t".join(["dataset", "read_ID", "fraction_aligned", 
+                           "identity"]) + "\n")
+        o.close()
+
+        novel_ids = {'datasets': {}, \
+                     'genes': {}, \
+                     'transcripts': {}, \
+                     'edges': {}, \
+                     'vertices': {}, \
+                     'observed': {}}
                  
-    all_sam_transcripts = []
-    abundances = {}
-    
-    # Identify input sam transcripts
-    for sam, d_metadata in zip(sam_files, dataset_list):
-
-        # Create new dataset entry for the database
-        d_id = str(counter['datasets'] + 1)
-        novel_tuple = (d_id, d_metadata[0], d_metadata[1], d_metadata[2])
-        d_name = d_metadata[0]
-        novel_ids['datasets'][d_id] = novel_tuple
-        counter['datasets'] += 1
-
-        print("Identifying transcripts in " + d_name + "...............")
-        sam_transcripts = process_sam_file(sam, d_name, min_coverage, 
-                                           min_identity, min_length, qc_file)
-        if len(sam_transcripts) == 0:
-            print("Warning: no transcripts detected in file " + sam)
-        identify_sam_transcripts(sam_transcripts, gene_tree, annot_transcripts, 
-                                 exon_tree, intron_tree, vertices, counter, 
-                                 d_name, novel_ids, abundances)
+        abundances = defaultdict(Counter)
+        out_txt, out_writer = init_outputs(out)
+
+        # Reading and filtering each SAM file is independent of the others, 
+        # so they can be parsed in parallel. Transcript identification updates
+        # the shared counters and must run serially, in dataset order.
+        sam_args = [(sam, d_metadata[0], min_coverage, min_identity, 
+                     min_length, qc_file) 
+                    for sam, d_metadata in zip(sam_files, dataset_list)]
+        if threads > 1 and len(sam_files) > 1:
+            pool = mp.Pool(processes = min(threads, len(sam_files), 
+                                           mp.cpu_count()))
+            pending = [pool.apply_async(process_sam_file, args) 
+                       for args in sam_args]
+            parsed_sams = (result.get() for result in pending)
+        else:
+            parsed_sams = (process_sam_file(*args) for args in sam_args)
         
-        all_sam_transcripts += sam_transcripts 
-
-    # Update database
-    if options.noUpdate == None:
-        print("Updating TALON database..................")
-        batch_size = 10000
-        update_database(annot, dataset_list, annot_transcripts, counter,
-                        novel_ids, abundances, batch_size, build)
-
-    print("Writing summary file output...............")
-    write_outputs(all_sam_transcripts, out)
-
+        # Identify input sam transcripts
+        for sam, d_metadata, sam_transcripts in zip(sam_files, dataset_list, 
+                                                    parsed_sams):
+
+            # Create new dataset entry for the database
+            d_id = counter["datasets"] + 1
+            novel_tuple = (d_id, d_metadata[0], d_metadata[1], d_metadata[2])
+            d_name = d_metadata[0]
+            novel_ids['datasets'][d_id] = novel_tuple
+            counter['datasets'] += 1
+
+            print("Identifying transcripts in " + d_name + "...............")
+            if len(sam_transcripts) == 0:
+                print("Warning: no transcripts detected in file " + sam)
+            identify_sam_transcripts(sam_transcripts, gene_tree, 
+                                     annot_transcripts, exon_tree, intron_tree,
+                                     vertices, counter, d_name, novel_ids,
+                                     abundances)
+            
+            # Write this dataset's assignments now rather than holding every 
+            # dataset's transcripts until the end of the run
+            print("Writing summary file output for " + d_name + \
+                  "...............")
+            write_outputs(sam_transcripts, out_writer)
+
+        if pool != None:
+            pool.close()
+            pool.join()
+            pool = None
+        out_txt.close()
+
+        # Update database
+        if options.noUpdate == None:
+            print("Updating TALON database..................")
+            update_database(conn, dataset_list, annot_transcripts, counter,
+                            novel_ids, abundances, build)
+    finally:
+        # On failure, make sure no worker processes or open handles are left
+        # behind. Closing an already-closed file is a no-op
+        if pool != None:
+            pool.terminate()
+        if out_txt != None:
+            out_txt.close()
+        conn.close()
 
 if __name__ == '__main__':
     main()
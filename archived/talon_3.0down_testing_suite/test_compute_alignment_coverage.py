@@ -1,3 +1,4 @@
+import pysam
 import pytest
 import sys
 sys.path.append("..")
@@ -8,5 +9,7 @@ def test_compute_alignment_coverage():
     """ Computes what fraction of the read is actually aligned to
         the genome by excluding hard or soft-clipped bases."""
     
-    cigar = "5S90M5H"
-    assert TALON.compute_alignment_coverage(cigar) == 0.9
+    read = pysam.AlignedSegment()
+    read.cigarstring = "5S90M5H"
+    cigar_stats = read.get_cigar_stats()[0]
+    assert TALON.compute_alignment_coverage(cigar_stats) == 0.9
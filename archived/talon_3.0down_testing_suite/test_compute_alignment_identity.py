@@ -1,23 +1,39 @@
+import pysam
 import pytest
 import sys
 sys.path.append("..")
 import talon as TALON
-@pytest.mark.unit
 
-def test_compute_alignment_coverage():
-    """ Computes what fraction of the read is actually aligned to
-        the genome by excluding hard or soft-clipped bases."""
+def make_read(cigar, NM, SEQ):
+    """ Build a minimal pysam record carrying a CIGAR, NM tag and sequence """
+    read = pysam.AlignedSegment()
+    read.query_sequence = SEQ
+    read.cigarstring = cigar
+    read.set_tag("NM", NM)
+    return read
+
+def compute_identity(read):
+    cigar_stats = read.get_cigar_stats()[0]
+    return TALON.compute_alignment_identity(cigar_stats, read.get_tag("NM"),
+                                            read.query_length)
+
+@pytest.mark.unit
+def test_compute_alignment_identity():
+    """ Computes what fraction of the read matches the reference genome."""
     
-    MD = "MD:Z:10A3T0T10"
+    # MD:Z:10A3T0T10
     SEQ = "GGGGGGGGGGTGGGAATGGGGGGGGGG"
-    assert TALON.compute_alignment_identity(MD, SEQ) == 23.0/27
+    read = make_read("10M1I16M", 4, SEQ)
+    assert compute_identity(read) == 23.0/27
 
-    MD = "MD:Z:56^A45"
+    # MD:Z:56^A45
     SEQ = "GGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGGG"
-    assert TALON.compute_alignment_identity(MD, SEQ) == 101.0/102
+    read = make_read("56M1D45M", 1, SEQ)
+    assert compute_identity(read) == 101.0/102
 
-    MD = "MD:Z:6G4C20G1A5C5A1^C3A15G1G15"
+    # MD:Z:6G4C20G1A5C5A1^C3A15G1G15
     SEQ = "GGGGGGAGGGGAGGGGGGGGGGGGGGGGGGGCGAGTGGGGGAGGGGGCGGGGTGGGGGGGGGGGGGGGAGAGGGGGGGGGGGGGGG" 
+    read = make_read("48M1D37M1I", 11, SEQ)
 
     align_length = len(SEQ) + 1 # incremented by 1 because of single deletion
-    assert TALON.compute_alignment_identity(MD, SEQ) == 76.0/align_length
+    assert compute_identity(read) == 76.0/align_length
@@ -0,0 +1,56 @@
+import pytest
+import random
+import sys
+sys.path.append("..")
+from edgetree import ImplicitIntervalTree
+
+@pytest.mark.unit
+class TestImplicitIntervalTree(object):
+    def test_half_open_overlap(self):
+        """ Intervals are half-open, so an interval ending where the query
+            starts is not reported, but one starting inside it is.
+        """
+        tree = ImplicitIntervalTree()
+        tree.add(1, 10, "a")
+        tree.add(10, 20, "b")
+        tree.add(25, 30, "c")
+        tree.build()
+
+        assert tree.overlap(10, 11) == ["b"]
+        assert sorted(tree.overlap(5, 26)) == ["a", "b", "c"]
+        assert tree.overlap(20, 25) == []
+
+    def test_pending_intervals(self):
+        """ Intervals added after build() must be found before and after
+            they are merged into the index.
+        """
+        tree = ImplicitIntervalTree()
+        tree.add(100, 200, "a")
+        tree.build()
+        tree.add(150, 160, "b")
+        assert sorted(tree.overlap(155, 156)) == ["a", "b"]
+
+        tree.build()
+        assert tree.pending == []
+        assert sorted(tree.overlap(155, 156)) == ["a", "b"]
+
+    def test_matches_brute_force(self):
+        """ Compare queries against a linear scan on random intervals of mixed
+            lengths, including a tree that is not complete.
+        """
+        rng = random.Random(7)
+        intervals = []
+        tree = ImplicitIntervalTree()
+        for i in range(203):
+            start = rng.randint(0, 5000)
+            end = start + rng.choice([1, 10, 100, 2000])
+            intervals.append((start, end, i))
+            tree.add(start, end, i)
+        tree.build()
+
+        for i in range(100):
+            q_start = rng.randint(0, 7000)
+            q_end = q_start + rng.randint(1, 300)
+            expected = [x[2] for x in intervals
+                        if x[0] < q_end and q_start < x[1]]
+            assert sorted(tree.overlap(q_start, q_end)) == sorted(expected)
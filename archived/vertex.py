@@ -2,6 +2,7 @@
 # Author: Dana Wyman
 #------------------------------------------------------------------------------
 
+import numpy as np
 import pdb
 
 class Vertex(object):
@@ -31,18 +32,102 @@ class Vertex(object):
         self.strand = strand
         self.gene_id = str(gene_id)
 
-def fetch_vertex(known_vertices, chromosome, pos, gene_id):
-    """ Look for a vertex matching the input criteria. Throw error if not found"""
-  
-    try:
-        vertex_matches = known_vertices[chromosome][pos]
-        for v in vertex_matches:
+class ChromVertices(object):
+    """ Stores the vertices of one chromosome as parallel NumPy arrays sorted 
+        by position (structure of arrays), so that the vertices at a position
+        are found with a binary search instead of per-vertex Python objects.
+        Vertices created during the run are kept in a small dictionary
+        alongside the arrays.
+
+        Lookups by position behave like a dict mapping position -> list of
+        Vertex objects, raising a KeyError if no vertex is at that position.
+        Attributes:
+            chromosome: Name of the chromosome
+            positions, vertex_ids, gene_ids: Sorted int64 arrays
+            strands: int8 array of strand codes (see STRAND_CODES)
+            novel: Dictionary mapping position -> list of novel Vertex objects
+    """
+    STRAND_CODES = {"+": 1, "-": -1}
+    STRAND_NAMES = {1: "+", -1: "-"}
+
+    def __init__(self, chromosome, positions = (), vertex_ids = (), 
+                 gene_ids = (), strands = ()):
+        self.chromosome = str(chromosome)
+        positions = np.asarray(positions, dtype = np.int64)
+        order = np.argsort(positions, kind = "stable")
+        self.positions = positions[order]
+        self.vertex_ids = np.asarray(vertex_ids, dtype = np.int64)[order]
+        self.gene_ids = np.asarray(gene_ids, dtype = np.int64)[order]
+        self.strands = np.asarray([self.STRAND_CODES.get(x, 0) for x in strands],
+                                  dtype = np.int8)[order]
+        self.novel = {}
+
+    def _position_range(self, pos):
+        """ Returns the slice bounds of the array entries located at pos """
+        lo = int(np.searchsorted(self.positions, pos, side = "left"))
+        hi = int(np.searchsorted(self.positions, pos, side = "right"))
+        return lo, hi
+
+    def add_vertex(self, vertex):
+        """ Adds a novel Vertex object """
+        if vertex.pos in self.novel:
+            self.novel[vertex.pos].append(vertex)
+        else:
+            self.novel[vertex.pos] = [vertex]
+        return
+
+    def find(self, pos, gene_id):
+        """ Returns the vertex at pos that belongs to the given gene, or None
+            if there is no such vertex """
+        gene_id = str(gene_id)
+        lo, hi = self._position_range(pos)
+        for i in range(lo, hi):
+            if str(self.gene_ids[i]) == gene_id:
+                return self._make_vertex(i)
+        for v in self.novel.get(pos, []):
             if v.gene_id == gene_id:
                 return v
+        return None
 
-    except Exception as e:
+    def genes_at(self, pos, strand):
+        """ Returns the gene IDs of the vertices at pos on the given strand """
+        lo, hi = self._position_range(pos)
+        code = self.STRAND_CODES.get(strand, 0)
+        genes = [str(g) for g, s in zip(self.gene_ids[lo:hi].tolist(),
+                                        self.strands[lo:hi].tolist()) 
+                 if s == code]
+        genes.extend(v.gene_id for v in self.novel.get(pos, []) 
+                     if v.strand == strand)
+        return genes
+
+    def _make_vertex(self, i):
+        return Vertex(self.vertex_ids[i], self.chromosome, self.positions[i],
+                      self.STRAND_NAMES.get(int(self.strands[i])), 
+                      self.gene_ids[i])
+
+    def __contains__(self, pos):
+        lo, hi = self._position_range(pos)
+        return hi > lo or pos in self.novel
+
+    def __getitem__(self, pos):
+        lo, hi = self._position_range(pos)
+        vertices = [self._make_vertex(i) for i in range(lo, hi)]
+        vertices.extend(self.novel.get(pos, []))
+        if len(vertices) == 0:
+            raise KeyError(pos)
+        return vertices
+
+    def __iter__(self):
+        positions = set(self.positions.tolist()) | set(self.novel)
+        return iter(sorted(positions))
+
+def fetch_vertex(known_vertices, chromosome, pos, gene_id):
+    """ Look for a vertex matching the input criteria. Throw error if not found"""
+  
+    if chromosome not in known_vertices or pos not in known_vertices[chromosome]:
         raise ValueError('Vertex at ' + chromosome + ':' + str(pos) + 
                          ' does not exist!')
+    return known_vertices[chromosome].find(pos, gene_id)
                 
 
 def search_for_gene(query_transcript, vertices):
@@ -54,16 +139,13 @@ def search_for_gene(query_transcript, vertices):
     chromosome = query_transcript.chromosome
     strand = query_transcript.strand
     exon_coords = query_transcript.get_exon_coords()
+    if chromosome not in vertices:
+        return None
+
+    chrom_vertices = vertices[chromosome]
     genes_seen = []
     for pos in exon_coords:
-        try:
-            matches = vertices[chromosome][pos]
-            for vertex in matches:
-                if vertex.strand == strand:
-                    genes_seen.append(vertex.gene_id)
-
-        except:
-            pass
+        genes_seen.extend(chrom_vertices.genes_at(pos, strand))
 
     if len(genes_seen) == 0:
         return None
@@ -71,14 +153,32 @@ def search_for_gene(query_transcript, vertices):
     return max(set(genes_seen), key=genes_seen.count)
     
 
+def get_or_create_vertex(known_vertices, chromosome, pos, strand, gene_id,
+                         novel_ids, counter):
+    """ Returns the ID of the vertex at pos belonging to gene_id. If there is
+        none, a novel vertex is created, added to known_vertices and recorded
+        in novel_ids """
+    if chromosome not in known_vertices:
+        known_vertices[chromosome] = ChromVertices(chromosome)
+    chrom_vertices = known_vertices[chromosome]
+
+    match = chrom_vertices.find(pos, gene_id)
+    if match != None:
+        return match.identifier
+
+    counter["vertices"] += 1
+    curr_novel = str(counter["vertices"])
+    new_vertex = Vertex(curr_novel, chromosome, pos, strand, gene_id)
+    novel_ids["vertices"][curr_novel] = (new_vertex.identifier, gene_id, 
+                                         chromosome, pos, strand)
+    chrom_vertices.add_vertex(new_vertex)
+    return new_vertex.identifier
 
 def try_vertex_update(edge, known_vertices, novel_ids, counter):
     """ Given a novel edge, this function determines whether novel vertice(s) are
         needed on one or both ends. If so, new objects are created and added
         to the known_vertices data structure """
 
-    # TODO: Clean up code using fetch_vertex as a helper
-
     chromosome = edge.chromosome
     gene_id = edge.gene_id
     strand = edge.strand
@@ -90,58 +190,8 @@ def try_vertex_update(edge, known_vertices, novel_ids, counter):
         v2_pos = edge.start
         v1_pos = edge.end
      
-    # First vertex
-    found = False
-
-    if chromosome in known_vertices:
-        if v1_pos in known_vertices[chromosome]: 
-            vertex_matches = known_vertices[chromosome][v1_pos]
-            for v in vertex_matches:
-                if v.gene_id == gene_id:
-                    edge.v1 = v.identifier
-                    found = True
-    if not found:
-        counter["vertices"] += 1
-        curr_novel = str(counter["vertices"])
-        new_vertex = Vertex(curr_novel, chromosome, v1_pos, strand, gene_id)
-        edge.v1 = new_vertex.identifier
-        vertex_tuple = (new_vertex.identifier, gene_id, chromosome, v1_pos, 
-                        strand)
-        novel_ids["vertices"][curr_novel] = vertex_tuple
-
-        if chromosome in known_vertices:
-            try:
-                known_vertices[chromosome][v1_pos].append(new_vertex)
-            except:
-                known_vertices[chromosome][v1_pos] = [new_vertex]      
-        else:
-            known_vertices[chromosome] = {}
-            known_vertices[chromosome][v1_pos] = [new_vertex]
-
-    # Second vertex
-    found = False 
-    if chromosome in known_vertices:
-        if v2_pos in known_vertices[chromosome]:
-            vertex_matches = known_vertices[chromosome][v2_pos]
-            for v in vertex_matches:
-                if v.gene_id == gene_id:
-                    edge.v2 = v.identifier
-                    found = True
-    if not found:
-        counter["vertices"] += 1
-        curr_novel = str(counter["vertices"])
-        new_vertex = Vertex(curr_novel, chromosome, v2_pos, strand, gene_id) 
-        edge.v2 = new_vertex.identifier
-        vertex_tuple = (new_vertex.identifier, gene_id, chromosome, v2_pos,
-                        strand)
-        novel_ids["vertices"][curr_novel] = vertex_tuple
-        if chromosome in known_vertices:
-            try:
-                known_vertices[chromosome][v2_pos].append(new_vertex)
-            except:
-                known_vertices[chromosome][v2_pos] = [new_vertex]
-        else:
-            known_vertices[chromosome] = {}
-            known_vertices[chromosome][v2_pos] = [new_vertex]
-
-    return 
+    edge.v1 = get_or_create_vertex(known_vertices, chromosome, v1_pos, strand,
+                                   gene_id, novel_ids, counter)
+    edge.v2 = get_or_create_vertex(known_vertices, chromosome, v2_pos, strand,
+                                   gene_id, novel_ids, counter)
+    return
@@ -46,7 +46,7 @@ class Edge(object):
         print(self.transcript_ids)
         return
 
-def create_edge_from_gtf(edge_info):
+def create_edge_from_gtf(edge_info, attributes = None):
     """ Creates an edge object using information from a GTF entry
             Args:
                edge_info: A list containing fields from a GTF file edge entry.
@@ -68,42 +68,48 @@ def create_edge_from_gtf(edge_info):
     chromosome = edge_info[0]
     strand = edge_info[6]
 
-    annotations = extract_edge_annotations_from_GTF(edge_info)
+    annotations = extract_edge_annotations_from_GTF(edge_info, attributes)
     if "exon_id" not in annotations:
         annotations["exon_id"] = "_".join([chromosome, str(start), str(end), strand])
     gene_id = annotations['gene_id']
     transcript_id = annotations['transcript_id']
     edge_id = "_".join([chromosome, str(start), str(end), strand])
 
+    # Take the first quoted value after each ID field. partition() avoids
+    # splitting the whole description into lists for every exon
     if "gene_id" in description:
-        gene_id = (description.split("gene_id ")[1]).split('"')[1]
+        field = description.partition("gene_id ")[2]
+        gene_id = field.partition('"')[2].partition('"')[0]
     if "transcript_id" in description:
-        transcript_id = (description.split("transcript_id ")[1]).split('"')[1]
+        field = description.partition("transcript_id ")[2]
+        transcript_id = field.partition('"')[2].partition('"')[0]
     
     edge = Edge(edge_id, chromosome, start, end, strand, gene_id, transcript_id,
                 annotations)
     return edge
 
-def extract_edge_annotations_from_GTF(tab_fields):
-    """ Extracts key-value annotations from the GTF description field
+def extract_edge_annotations_from_GTF(tab_fields, attributes = None):
+    """ Extracts key-value annotations from the GTF description field, unless
+        they have already been parsed into an attribute dictionary
     """
 
-    attributes = {}
+    if attributes is None:
+        attributes = {}
 
-    # remove trailing newline and split by semicolon
-    description = tab_fields[-1].strip('\n')
-    description = description.split(';')
+        # remove trailing newline and split by semicolon
+        description = tab_fields[-1].strip('\n')
+        description = description.split(';')
 
-    # Parse description
-    for fields in description:
-        if fields == "" or fields == " ": continue
-        fields = fields.split()
-        if fields[0] == '': fields = fields[1:]
+        # Parse description
+        for fields in description:
+            if fields == "" or fields == " ": continue
+            fields = fields.split()
+            if fields[0] == '': fields = fields[1:]
 
-        key = fields[0].replace('"', '')
-        val = ' '.join(fields[1:]).replace('"', '')
+            key = fields[0].replace('"', '')
+            val = ' '.join(fields[1:]).replace('"', '')
         
-        attributes[key] = val
+            attributes[key] = val
 
     # Put in placeholders for important attributes (such as gene_id) if they
     # are absent
@@ -116,21 +122,20 @@ def extract_edge_annotations_from_GTF(tab_fields):
 
     return attributes
 
-def get_edge_from_db(vertex_info_1, vertex_info_2):
-    """ Uses information from a database edge entry to create an edge object.
+def get_edge_from_db(edge_row):
+    """ Uses information from a database edge entry (joined to the locations
+        of both of its vertices) to create an edge object.
+        Args:
+            edge_row: Tuple-formatted row containing the edge ID, chromosome,
+            v1 position, v2 position, strand, v1 ID, v2 ID, and gene ID
     """
-    if vertex_info_1["edge_id"] != vertex_info_2["edge_id"]:
-        raise ValueError('Tried to create edge from endpoints with different IDs')
-    edge_id = vertex_info_1["edge_id"]
-    chromosome = vertex_info_1['chromosome']
-    start = min(vertex_info_1['position'], vertex_info_2['position'])
-    end = max(vertex_info_1['position'], vertex_info_2['position']) 
-    strand = vertex_info_1['strand']
-    gene_id = vertex_info_1['gene_id']
+    edge_id, chromosome, v1_pos, v2_pos, strand, v1, v2, gene_id = edge_row
+    start = min(v1_pos, v2_pos)
+    end = max(v1_pos, v2_pos)
 
     edge = Edge(edge_id, chromosome, start, end, strand, gene_id, None, None)
-    edge.v1 = str(vertex_info_1["vertex_ID"])
-    edge.v2 = str(vertex_info_2["vertex_ID"])
+    edge.v1 = str(v1)
+    edge.v2 = str(v2)
     return edge
 
 def create_novel_edge(chromosome, start, end, strand, gene_id, transcript_id, counter):
@@ -82,28 +82,22 @@ class Gene(object):
 
         return
 
-def get_gene_from_db(gene_start_row, gene_end_row):
+def get_gene_from_db(gene_row):
     """ Uses information from a database gene entry to create a
     Gene object.
         Args:
-            gene_row: Tuple-formatted row from 'genes' table of a
-            TALON database
+            gene_row: Tuple-formatted row containing the gene ID, chromosome,
+            start (min vertex position), end (max vertex position), and strand
+            of a gene in a TALON database
     """
-    if gene_start_row['gene_id'] != gene_end_row['gene_id']:
-            raise ValueError("get_gene_from_db: provided start and stop " + \
-                             "come from different genes")
-    gene_id = gene_start_row['gene_ID']
-    chromosome = gene_start_row['chromosome']
-    start = gene_start_row[2]
-    end = gene_end_row[2]
-    strand = gene_start_row['strand']
+    gene_id, chromosome, start, end, strand = gene_row
 
     #transcripts = {} #gene_row['transcript_ids'].split(",")
 
     gene = Gene(gene_id, chromosome, start, end, strand, {})
     return gene
 
-def get_gene_from_gtf(gene_info):
+def get_gene_from_gtf(gene_info, attributes = None):
     """ Creates a Gene object from a GTF file entry
         Args:
             gene_info: A list containing fields from a GTF file gene entry.
@@ -118,7 +112,7 @@ def get_gene_from_gtf(gene_info):
     start = int(gene_info[3])
     end = int(gene_info[4])
     strand = gene_info[6]
-    annotations = extract_gene_annotations_from_GTF(gene_info)
+    annotations = extract_gene_annotations_from_GTF(gene_info, attributes)
     if "gene_id" not in gene_info[-1]:
             raise ValueError('GTF entry lacks a gene_id field')
     gene_id = annotations['gene_id']
@@ -126,27 +120,29 @@ def get_gene_from_gtf(gene_info):
     gene = Gene(gene_id, chromosome, start, end, strand, annotations)
     return gene
 
-def extract_gene_annotations_from_GTF(tab_fields):
+def extract_gene_annotations_from_GTF(tab_fields, attributes = None):
     """Parses the description field of a gene GTF in order to organize the 
-       information therein into a dictionary.
+       information therein into a dictionary. If the description has already
+       been parsed into an attribute dictionary, that dictionary is used.
     """
 
-    attributes = {}
+    if attributes is None:
+        attributes = {}
 
-    # remove trailing newline and split by semicolon
-    description = tab_fields[-1].strip('\n')
-    description = description.split(';')
+        # remove trailing newline and split by semicolon
+        description = tab_fields[-1].strip('\n')
+        description = description.split(';')
 
-    # Parse description
-    for fields in description:
-        if fields == "" or fields == " ": continue
-        fields = fields.split()
-        if fields[0] == '': fields = fields[1:]
+        # Parse description
+        for fields in description:
+            if fields == "" or fields == " ": continue
+            fields = fields.split()
+            if fields[0] == '': fields = fields[1:]
 
-        key = fields[0].replace('"', '')
-        val = ' '.join(fields[1:]).replace('"', '')
+            key = fields[0].replace('"', '')
+            val = ' '.join(fields[1:]).replace('"', '')
         
-        attributes[key] = val
+            attributes[key] = val
 
     attributes["source"] = tab_fields[1]
 
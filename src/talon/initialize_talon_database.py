@@ -13,7 +13,44 @@ from . import gene as Gene
 from . import transcript as Transcript
 from . import edge as Edge
 import os
+import sys
 import time
+from collections import defaultdict
+from itertools import cycle, islice
+
+# Statements used when loading the annotation into the database
+INSERT_GENE = 'INSERT INTO "genes" ("gene_id", "strand") VALUES (?,?)'
+INSERT_GENE_ANNOT = """INSERT INTO "gene_annotations" ("ID", "annot_name",
+                       "source", "attribute", "value") VALUES (?,?,?,?,?)"""
+INSERT_TRANSCRIPT = """INSERT INTO "transcripts" ("transcript_ID", "gene_ID",
+                       "start_exon", "jn_path", "end_exon", "start_vertex",
+                       "end_vertex", "n_exons") VALUES (?,?,?,?,?,?,?,?)"""
+INSERT_TRANSCRIPT_ANNOT = """INSERT INTO "transcript_annotations" ("ID",
+                             "annot_name", "source", "attribute", "value")
+                             VALUES (?,?,?,?,?)"""
+INSERT_EXON_ANNOT = """INSERT OR IGNORE INTO "exon_annotations" ("ID",
+                       "annot_name", "source", "attribute", "value")
+                       VALUES (?,?,?,?,?)"""
+INSERT_VERTEX = 'INSERT INTO "vertex" ("vertex_ID", "gene_id") VALUES (?,?)'
+INSERT_LOCATION = """INSERT INTO "location" ("location_ID", "genome_build",
+                     "chromosome", "position") VALUES (?,?,?,?)"""
+INSERT_EDGE = """INSERT INTO "edge" ("edge_ID", "v1", "v2", "edge_type",
+                 "strand") VALUES (?,?,?,?,?)"""
+UPDATE_COUNTER = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
+
+# Lowest default limit on bound parameters per statement across SQLite versions
+MAX_SQL_VARIABLES = 999
+
+class IDCounters(object):
+    """ Last gene, transcript, vertex, and edge IDs issued while populating
+        the database """
+    __slots__ = ("gene", "transcript", "vertex", "edge")
+
+    def __init__(self, gene, transcript, vertex, edge):
+        self.gene = gene
+        self.transcript = transcript
+        self.vertex = vertex
+        self.edge = edge
 
 def getOptions():
     parser = OptionParser()
@@ -42,6 +79,9 @@ def getOptions():
     parser.add_option("--o", dest = "outprefix",
         help = "Outprefix for the annotation files",
         metavar = "FILE", type = "string")
+    parser.add_option("--verbose", dest = "verbose",
+        help = "Verbose mode: report each bulk insert step in the terminal",
+        action = "store_true", default = False)
 
     (options, args) = parser.parse_args()
     return options
@@ -65,65 +105,41 @@ def create_database(path):
 
     return
 
-def init_run_info(database, idprefix, min_length, cutoff_5p, cutoff_3p):
+def init_run_info(c, idprefix, min_length, cutoff_5p, cutoff_3p):
     """ Initializes a table that keeps track of important run information
         such as the prefix for novel identifiers and the 5 prime and 3 prime 
         distance cutoffs. Affects how downstream TALON runs are done"""
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column, which will be the gene ID
     c.execute("""CREATE TABLE "run_info" ("item" TEXT PRIMARY KEY,
                                           "value" TEXT)""")
     # Add rows
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["item", "value"]]) + ") "
-    c.execute('INSERT INTO run_info ' + cols + ' VALUES ' + '(?,?)',
-             ('schema_version', "v5.0"))
-    c.execute('INSERT INTO run_info ' + cols + ' VALUES ' + '(?,?)',
-             ('idprefix', idprefix))
-    c.execute('INSERT INTO run_info ' + cols + ' VALUES ' + '(?,?)', 
-             ('cutoff_5p', cutoff_5p))
-    c.execute('INSERT INTO run_info ' + cols + ' VALUES ' + '(?,?)',
-               ('cutoff_3p', cutoff_3p))
-    c.execute('INSERT INTO run_info ' + cols + ' VALUES ' + '(?,?)',
-               ('min_length', min_length))
-    c.execute('INSERT INTO run_info ' + cols + ' VALUES ' + '(?,?)',
-               ('n_places', 9))
-
-    conn.commit()
-    conn.close()
+    c.executemany('INSERT INTO "run_info" ("item", "value") VALUES (?, ?)',
+                  [('schema_version', "v5.0"),
+                   ('idprefix', idprefix),
+                   ('cutoff_5p', cutoff_5p),
+                   ('cutoff_3p', cutoff_3p),
+                   ('min_length', min_length),
+                   ('n_places', 9)])
     return 
 
-def add_gene_table(database):
+def add_gene_table(c):
     """ Add a table to the database to track genes. Attributes are:
         - Primary Key: Gene ID (interally assigned by database)
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column, which will be the gene ID
     c.execute("""CREATE TABLE "genes" ("gene_ID" INTEGER PRIMARY KEY,
                                        "strand" TEXT)""")
-
-    conn.commit()
-    conn.close()
     return
 
-def add_transcript_table(database):
+def add_transcript_table(c):
     """ Add a table to the database to track transcripts. Attributes are:
         - Primary Key: Transcript ID (interally assigned by database)
         - Gene ID
         - Path (Edges)
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     command = """ CREATE TABLE IF NOT EXISTS transcripts (
                 transcript_ID INTEGER PRIMARY KEY,
                 gene_ID INTEGER,
@@ -142,11 +158,9 @@ def add_transcript_table(database):
                 ); """
 
     c.execute(command)
-    conn.commit()
-    conn.close()
     return
 
-def add_edge_table(database):
+def add_edge_table(c):
     """ Add a table to the database to track edges linking vertices. 
         Attributes are:
         - Primary Key: ID (interally assigned by database)
@@ -154,12 +168,8 @@ def add_edge_table(database):
         - Acceptor ID
     """
     
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Create edge type table first. 
-    add_edgetype_table(database)
+    add_edgetype_table(c)
 
     # Add edge table and set keys
     command = """ CREATE TABLE IF NOT EXISTS edge (
@@ -176,20 +186,14 @@ def add_edge_table(database):
                 ); """
 
     c.execute(command)
-    conn.commit()
-    conn.close()
     return
 
-def add_edgetype_table(database):
+def add_edgetype_table(c):
     """ Add a table to the database to track permitted edge types. We start
         with "edge" and "intron"
         Attributes are:
         - Primary Key: Type
     """
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column, which will be the transcript ID
     # Also include relationship to the gene table
     command = """CREATE TABLE IF NOT EXISTS edge_type (type TEXT PRIMARY KEY);"""
@@ -202,23 +206,15 @@ def add_edgetype_table(database):
         command = 'INSERT OR IGNORE INTO "edge_type"' + cols + "VALUES " + \
                   '(?)'
         c.execute(command,vals)
-
-    conn.commit()
-    conn.close()
     return
 
-def add_vertex_table(database):
+def add_vertex_table(c):
     """ Add a table to the database to track vertices.
         Attributes are:
         - Vertex_ID: ID (interally assigned by database)
         - Gene ID
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
-
     # Add table and set primary key column, which will be the transcript ID
     # Also include relationship to the gene table
     command = """ CREATE TABLE IF NOT EXISTS vertex (
@@ -231,19 +227,13 @@ def add_vertex_table(database):
                 ); """
 
     c.execute(command)
-    conn.commit()
-    conn.close()
     return
 
-def add_genome_table(database, build):
+def add_genome_table(c, build):
     """ Add a table that tracks the genome builds in use, then add the provided
         genome build to it.
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column, which will be the edge ID
     c.execute("""CREATE TABLE genome_build (
                      build_ID INTEGER PRIMARY KEY,
@@ -263,21 +253,13 @@ def add_genome_table(database, build):
     c.execute(command,vals)
 
     # Update the counter
-    update_counter = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
-    c.execute(update_counter, [counter, "genome_build"])
-
-    conn.commit()
-    conn.close()
+    c.execute(UPDATE_COUNTER, [counter, "genome_build"])
     return
 
-def add_dataset_table(database):
+def add_dataset_table(c):
     """ Add a table that tracks the datasets added to the database.
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column
     c.execute("""CREATE TABLE dataset (
                      dataset_ID INTEGER PRIMARY KEY,
@@ -285,19 +267,12 @@ def add_dataset_table(database):
                      sample TEXT,
                      platform TEXT
               )""")
-
-    conn.commit()
-    conn.close()
     return
 
-def add_observed_table(database):
+def add_observed_table(c):
     """ Add a table that tracks attributes of observed transcripts, including
         5' and 3' end deltas, as well as the read length. """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column
     c.execute("""CREATE TABLE observed (
                      obs_ID INTEGER PRIMARY KEY,
@@ -326,12 +301,9 @@ def add_observed_table(database):
                      FOREIGN KEY(start_exon) REFERENCES edge(edge_ID),
                      FOREIGN KEY(end_exon) REFERENCES edge(edge_ID)
               )""")
-
-    conn.commit()
-    conn.close()
     return
 
-def add_abundance_table(database):
+def add_abundance_table(c):
     """ Add a table to the database to track transcript abundance over
         all datasets.
         - Transcript ID 
@@ -339,10 +311,6 @@ def add_abundance_table(database):
         - Count
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column, which will be the edge ID
     c.execute("""CREATE TABLE abundance (
                      transcript_ID INTEGER,
@@ -353,21 +321,14 @@ def add_abundance_table(database):
                  FOREIGN KEY(transcript_ID) REFERENCES transcripts(transcript_ID),
                  FOREIGN KEY(dataset) REFERENCES dataset(dataset_ID)    
               )""")
-
-    conn.commit()
-    conn.close()
     return
 
-def add_counter_table(database):
+def add_counter_table(c):
     """ Add a table to the database to track novel events. Attributes are:
         - Category (gene, transcript, edge)
         - Count (number of items in that category so far)
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table and set primary key column
     table_name = "counters"
     c.execute('CREATE TABLE "counters" ("category" TEXT PRIMARY KEY)')
@@ -378,26 +339,13 @@ def add_counter_table(database):
         .format(tn=table_name, cn="count", ct="INTEGER", df=default_val))
 
     # Add rows
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('genes', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('transcripts', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('vertex', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('edge', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('genome_build', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('dataset', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-    c.execute("INSERT INTO {tn} ({idf}, {cn}) VALUES ('observed', 0)".\
-        format(tn=table_name, idf="category", cn="count"))
-
-    conn.commit()
-    conn.close()
+    categories = ["genes", "transcripts", "vertex", "edge", "genome_build",
+                  "dataset", "observed"]
+    c.executemany('INSERT INTO "counters" ("category", "count") VALUES (?, 0)',
+                  [(category,) for category in categories])
     return
 
-def add_annotation_table(database, table_name, key_table, fk_id):
+def add_annotation_table(c, table_name, key_table, fk_id):
     """ Add a table to keep track of annotation attributes for genes,
         transcripts, etc. The table will be given the provided table name. A
         foreign key will be created to link the ID column of the annotation
@@ -412,10 +360,6 @@ def add_annotation_table(database, table_name, key_table, fk_id):
         - Value
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table
     if key_table == "exon":
         fk_statement = ""
@@ -430,11 +374,9 @@ def add_annotation_table(database, table_name, key_table, fk_id):
                    
                   PRIMARY KEY (ID, source, attribute)""" + fk_statement + """); """
     c.execute(command)
-    conn.commit()
-    conn.close()
     return
 
-def add_location_table(database):
+def add_location_table(c):
     """ Add a table to the database to track the locations of objects across
         the different genome builds. Attributes are:
         - Vertex ID
@@ -444,10 +386,6 @@ def add_location_table(database):
         - Strand
     """
 
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
-    c = conn.cursor()
-
     # Add table
     command = """ CREATE TABLE IF NOT EXISTS location (
                   location_ID INTEGER,
@@ -459,6 +397,26 @@ def add_location_table(database):
                   FOREIGN KEY(genome_build) REFERENCES genome_build(build_ID)
                   ); """
     c.execute(command)
+    return
+
+def add_indexes(database):
+    """ Add secondary indexes used when looking up genes and monoexonic
+        transcripts by location. These are created after the annotation has
+        been loaded so that the bulk inserts don't have to maintain them.
+        - vertex: gene ID
+        - transcripts: gene ID
+        - location: genome build, chromosome, and position
+    """
+
+    # Connecting to the database file
+    conn = sqlite3.connect(database)
+    c = conn.cursor()
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_vertex_gene ON vertex(gene_ID)")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_transcripts_gene
+                 ON transcripts(gene_ID)""")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_location_pos
+                 ON location(genome_build, chromosome, position)""")
 
     conn.commit()
     conn.close()
@@ -480,29 +438,43 @@ def read_gtf_file(gtf_file):
     genes = {}
     transcripts = {}
     exons = {}
+    entry_types = {b"gene", b"transcript", b"exon"}
 
-    with open(gtf_file) as gtf:
-        for line in gtf:
-            line = line.strip()
+    # Read raw bytes through a large buffer so that header lines and entry
+    # types we don't use (UTRs, CDS, etc.) are skipped without being decoded
+    with open(gtf_file, "rb", buffering = 10*1024*1024) as gtf:
+        for raw in gtf:
 
             # Ignore header
-            if line.startswith("#"):
+            if raw[:1] == b"#":
+                continue
+
+            # Check the entry type before splitting the whole line
+            fields = raw.split(b"\t", 3)
+            if len(fields) < 3 or fields[2] not in entry_types:
                 continue
 
-            # Split into constitutive fields on tab
-            tab_fields = line.split("\t")
+            # Split into constitutive fields on tab. Chromosome, source, and
+            # strand take only a handful of values, so intern them to avoid
+            # keeping a separate copy in every gene, transcript, and exon
+            tab_fields = raw.decode().strip().split("\t")
+            tab_fields[0] = sys.intern(tab_fields[0])
+            tab_fields[1] = sys.intern(tab_fields[1])
+            tab_fields[6] = sys.intern(tab_fields[6])
             chrom = tab_fields[0]
             entry_type = tab_fields[2]
+            attributes = parse_gtf_attributes(tab_fields[-1])
 
             # Entry is a gene
             if entry_type == "gene":
-                gene = Gene.get_gene_from_gtf(tab_fields)
+                gene = Gene.get_gene_from_gtf(tab_fields, attributes)
                 native_id = gene.identifier
                 genes[native_id] = gene
 
             # Entry is a transcript
             elif entry_type == "transcript":
-                transcript = Transcript.get_transcript_from_gtf(tab_fields)
+                transcript = Transcript.get_transcript_from_gtf(tab_fields,
+                                                             attributes)
                 gene_id = transcript.gene_id
                 if gene_id in genes:
                     genes[gene_id].add_transcript(transcript)
@@ -511,21 +483,19 @@ def read_gtf_file(gtf_file):
                 
             # Entry is an edge
             elif entry_type == "exon":
-                exon = Edge.create_edge_from_gtf(tab_fields)
+                # Every exon row is parsed, because the transcript that owns it
+                # contributes its own exon annotations to the database
+                exon = Edge.create_edge_from_gtf(tab_fields, attributes)
                 # This ID is used because of a rare GENCODE bug
                 location_exon_id = exon.identifier
-                exons[location_exon_id] = exon 
-
                 transcript_id = list(exon.transcript_ids)[0]
-                gene_id = exon.annotations["gene_id"]
-                
+
                 if location_exon_id not in exons:
                     # Add the new edge to the data structure
                     exons[location_exon_id] = exon
                 else:
                     # Update existing exon entry, including its transcript set
-                    exon = exons[location_exon_id]
-                    exon.transcript_ids.add(transcript_id)
+                    exons[location_exon_id].transcript_ids.add(transcript_id)
            
                 if transcript_id in transcripts:         
                     currTranscript = transcripts[transcript_id]
@@ -533,92 +503,108 @@ def read_gtf_file(gtf_file):
 
     return genes, transcripts, exons
 
+def parse_gtf_attributes(description):
+    """ Parses the description field of a GTF entry into a dictionary mapping
+        each attribute to its value, with quotes removed. Repeated attributes
+        (such as "tag") keep the last value, as in the GTF object parsers.
+    """
+    attributes = {}
+    for field in description.split(";"):
+        key, _, value = field.strip().partition(" ")
+        if key:
+            attributes[key] = value.replace('"', '')
+
+    return attributes
+
 def filter_by_length(genes, transcripts, min_length):
     """ Given a minimum transcript length, this function
           - Iterates over transcripts and keeps the ones with length >= min_length
           - Removes genes not represented in the transcript set
     """
-    filtered_transcripts = {}
-    filtered_genes = {}
-
-    for transcript_id in transcripts:
-        curr_transcript = transcripts[transcript_id]
-        length = curr_transcript.get_length()
-
-        if length >= min_length:
-            filtered_transcripts[transcript_id] = curr_transcript
-            gene_id = curr_transcript.gene_id
-            if gene_id in genes:
-                filtered_genes[gene_id] = genes[gene_id]
+    filtered_transcripts = { transcript_id: transcript for transcript_id,
+                             transcript in transcripts.items()
+                             if transcript.get_length() >= min_length }
+    filtered_genes = { transcript.gene_id: genes[transcript.gene_id]
+                       for transcript in filtered_transcripts.values()
+                       if transcript.gene_id in genes }
 
     return filtered_genes, filtered_transcripts
 
 def organize_by_chromosome(genes, transcripts):
     """ Iterate through genes and transcripts and group them by chromosome """
-    gene_dict = {}
-    transcript_dict = {}
-
-    for ID in genes:
-        gene = genes[ID]
-        chromosome = gene.chromosome
-        if chromosome not in gene_dict:
-            chrom_genes = {}
-            chrom_genes[ID] = gene
-            gene_dict[chromosome] = chrom_genes
-        gene_dict[chromosome][ID] = gene
-
-    for ID in transcripts:
-        transcript = transcripts[ID]
-        chromosome = transcript.chromosome
-        if chromosome not in transcript_dict:
-            chrom_transcripts = {}
-            chrom_transcripts[ID] = transcript
-            transcript_dict[chromosome] = chrom_transcripts
-            transcript_dict[chromosome][ID] = transcript
-        transcript_dict[chromosome][ID] = transcript
-
-    return gene_dict, transcript_dict
+    gene_dict = defaultdict(dict)
+    transcript_dict = defaultdict(dict)
+
+    for ID, gene in genes.items():
+        gene_dict[gene.chromosome][ID] = gene
+
+    for ID, transcript in transcripts.items():
+        transcript_dict[transcript.chromosome][ID] = transcript
+
+    return dict(gene_dict), dict(transcript_dict)
 
 ######################### Populate the database ############################
 
-def populate_db(database, annot_name, chrom_genes, chrom_transcripts, edges, genome_build):
+def populate_db(database, annot_name, chrom_genes, chrom_transcripts, edges,
+                genome_build, verbose = False):
     """ Iterate over GTF-derived gene, transcript, and edge entries in order
         to add a record for each in the database.
     """
-    # Connecting to the database file
-    conn = sqlite3.connect(database)
+    # Connecting to the database file. The whole load runs as one explicit
+    # transaction so that SQLite does not sync to disk after every chromosome
+    conn = sqlite3.connect(database, isolation_level = None)
     c = conn.cursor()
+    c.executescript("""PRAGMA journal_mode=WAL;
+                       PRAGMA synchronous=OFF;
+                       PRAGMA temp_store=MEMORY;
+                       PRAGMA cache_size=-262144;""")
+    c.execute("BEGIN IMMEDIATE")
 
-    for chromosome in chrom_genes.keys():
-        start_time = time.time()
-        print(chromosome)
-        genes = chrom_genes[chromosome]
-        transcripts = chrom_transcripts[chromosome]        
-
-        gene_id_map = add_genes(c, genes, annot_name)
-        add_transcripts(c, transcripts, annot_name, gene_id_map, genome_build)
+    try:
+        # Read the counters once and keep them in memory for the whole load
+        counts = dict(c.execute('SELECT "category", "count" FROM "counters"'))
+        counters = IDCounters(counts["genes"], counts["transcripts"],
+                              counts["vertex"], counts["edge"])
+
+        for chromosome in chrom_genes.keys():
+            start_time = time.time()
+            print(chromosome)
+            genes = chrom_genes[chromosome]
+            transcripts = chrom_transcripts[chromosome]        
+
+            gene_id_map = add_genes(c, genes, annot_name, counters, verbose)
+            add_transcripts(c, transcripts, annot_name, gene_id_map,
+                            genome_build, counters, verbose)
+
+            end_time = time.time()
+            print("It took {} to process chromosome".format(hms_string(end_time - start_time)))
+
+        # Write the counters back
+        c.executemany(UPDATE_COUNTER, [(counters.gene, "genes"),
+                                       (counters.transcript, "transcripts"),
+                                       (counters.vertex, "vertex"),
+                                       (counters.edge, "edge")])
+    except:
+        # Leave the database as it was before the load started
+        c.execute("ROLLBACK")
+        conn.close()
+        raise
 
-        conn.commit()
-        end_time = time.time()
-        print("It took {} to process chromosome".format(hms_string(end_time - start_time)))
+    c.execute("COMMIT")
     conn.close()
     
     return
 
-def add_genes(c, genes, annot_name):
+def add_genes(c, genes, annot_name, counters, verbose = False):
 
     bulk_genes = []
     bulk_annotations = []
     gene_id_map = {}
 
-    # Fetch value of gene counter
-    c.execute('SELECT "count" FROM "counters" WHERE "category" = "genes"')
-    gene_counter = int(c.fetchone()[0])
-
     for gene_id in genes:
         gene = genes[gene_id]
-        db_gene_id = gene_counter + 1
-        gene_counter += 1
+        counters.gene += 1
+        db_gene_id = counters.gene
 
         # Information for gene table
         bulk_genes.append((db_gene_id, gene.strand))
@@ -631,29 +617,48 @@ def add_genes(c, genes, annot_name):
 
         if "gene_status" not in attributes:
             attributes["gene_status"] = "KNOWN"
-        for att in attributes.keys():
-            value = attributes[att]
-            bulk_annotations.append((db_gene_id, annot_name, source, att, value))
-
-    print("bulk update genes...")
-    bulk_update_genes(c, bulk_genes, gene_counter)
-    print("bulk update gene_annotations...")
+        bulk_annotations.extend((db_gene_id, annot_name, source, att, value)
+                                for att, value in attributes.items())
+
+    if verbose:
+        print("bulk update genes...")
+    bulk_update_genes(c, bulk_genes)
+    if verbose:
+        print("bulk update gene_annotations...")
     bulk_update_gene_annotations(c, bulk_annotations)
     return gene_id_map
  
-def bulk_update_genes(c, genes, gene_counter):
+def multi_insert(c, command, rows):
+    """
+       Given a single-row INSERT command ending in a VALUES placeholder group,
+       this function inserts the tuple-formatted rows at the provided cursor
+       (c) using statements that carry as many rows as SQLite allows.
+    """
+    prefix, placeholders = command.rsplit("VALUES", 1)
+    placeholders = placeholders.strip()
+    n_rows = max(1, MAX_SQL_VARIABLES // placeholders.count("?"))
+    full_command = prefix + "VALUES " + ",".join([placeholders] * n_rows)
+
+    rows = iter(rows)
+    group = list(islice(rows, n_rows))
+    while group:
+        if len(group) == n_rows:
+            group_command = full_command
+        else:
+            group_command = prefix + "VALUES " + \
+                            ",".join([placeholders] * len(group))
+        c.execute(group_command, [value for row in group for value in row])
+        group = list(islice(rows, n_rows))
+
+    return
+
+def bulk_update_genes(c, genes):
     """
        Given a list of tuple-formatted gene entries, this function inserts them
        into the database at the provided cursor (c).
     """
     # Insert entries into database in bulk
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["gene_id", "strand"]]) + ") "
-    g_command = 'INSERT INTO "genes"' + cols + "VALUES " + '(?,?)'
-    c.executemany(g_command, genes)
-
-    # Update counter
-    update_counter = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
-    c.execute(update_counter, [gene_counter, "genes"])
+    multi_insert(c, INSERT_GENE, genes)
 
     return
 
@@ -663,41 +668,32 @@ def bulk_update_gene_annotations(c, bulk_annotations):
        inserts them into the database at the provided cursor (c).
     """
 
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["ID","annot_name",
-               "source", "attribute", "value"]]) + ") "
-    command = 'INSERT INTO "gene_annotations"' + cols + "VALUES " + \
-                  '(?,?,?,?,?)'
-    c.executemany(command, bulk_annotations)
+    multi_insert(c, INSERT_GENE_ANNOT, bulk_annotations)
 
     return 
 
-def add_transcripts(c, transcripts, annot_name, gene_id_map, genome_build):
+def add_transcripts(c, transcripts, annot_name, gene_id_map, genome_build,
+                    counters, verbose = False):
 
     bulk_transcripts = []
     bulk_annotations = []
+    bulk_exon_annotations = []
 
-    # Keep track of vertices and edges as they are created
+    # Keep track of vertices and edges as they are created. The maps point
+    # from a vertex/edge key to its ID, while the remaining structures hold
+    # the rows that will be inserted into the database. All transcripts
+    # passed in share one chromosome, so vertices are keyed by position
     vertices = {}
+    vertex_genes = {}
+    locations = []
     edges = {}
-
-    # Get vertex and edge counters from database
-    c.execute('SELECT "count" FROM "counters" WHERE "category" = "vertex"')
-    v_counter = int(c.fetchone()[0])
-    vertices['counter'] = v_counter
-
-    c.execute('SELECT "count" FROM "counters" WHERE "category" = "edge"')
-    e_counter = int(c.fetchone()[0])
-    edges['counter'] = e_counter
-
-    # Get transcript counter
-    c.execute('SELECT "count" FROM "counters" WHERE "category" = "transcripts"')
-    counter = int(c.fetchone()[0])
+    edge_rows = []
 
     for transcript_id in transcripts:
         # Create transcript entry
         transcript = transcripts[transcript_id]
-        db_transcript_id = counter + 1
-        counter += 1
+        counters.transcript += 1
+        db_transcript_id = counters.transcript
 
         # Extract annotation items and find database-issued gene ID if possible
         attributes = transcript.annotations
@@ -712,44 +708,42 @@ def add_transcripts(c, transcripts, annot_name, gene_id_map, genome_build):
         # Process exons to create vertices and edges 
         transcript_tuple = process_transcript(c, transcript, db_transcript_id, 
                                               db_gene_id, genome_build,
-                                              annot_name, vertices, edges)
+                                              annot_name, vertices, vertex_genes,
+                                              locations, edges, edge_rows,
+                                              counters, bulk_exon_annotations)
         bulk_transcripts.append(transcript_tuple)
 
-        # Create annotation entries
-        ignore = ["gene_id", "gene_name"]
+        # Create annotation entries, leaving out gene-level attributes
         if "transcript_status" not in attributes:
             attributes["transcript_status"] = "KNOWN"
-        for att in attributes.keys():
-            if att in ignore or "gene" in att:
-                continue
-            value = attributes[att]
-            bulk_annotations.append((db_transcript_id, annot_name, source, att, value))
+        bulk_annotations.extend((db_transcript_id, annot_name, source, att, value)
+                                for att, value in attributes.items()
+                                if "gene" not in att)
  
-    print("bulk update transcripts...")
-    bulk_update_transcripts(c, bulk_transcripts, counter)
-    print("bulk update annotations...")
+    if verbose:
+        print("bulk update transcripts...")
+    bulk_update_transcripts(c, bulk_transcripts)
+    if verbose:
+        print("bulk update annotations...")
     bulk_update_transcript_annotations(c, bulk_annotations)
-    print("bulk update vertices/locations...")
-    bulk_update_vertices(c, vertices)
-    print("bulk update edges...")
-    bulk_update_edges(c, edges)
+    if verbose:
+        print("bulk update exon annotations...")
+    bulk_update_exon_annotations(c, bulk_exon_annotations)
+    if verbose:
+        print("bulk update vertices/locations...")
+    bulk_update_vertices(c, vertex_genes, locations)
+    if verbose:
+        print("bulk update edges...")
+    bulk_update_edges(c, edge_rows)
 
     return
 
-def bulk_update_transcripts(c, transcripts, counter):
+def bulk_update_transcripts(c, transcripts):
     """
        Given a list of tuple-formatted transcript entries, this function inserts them
        into the database at the provided cursor (c).
     """
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["transcript_ID",
-           "gene_ID", "start_exon", "jn_path", "end_exon", "start_vertex", "end_vertex", 
-           "n_exons"]]) + ") "
-    g_command = 'INSERT INTO "transcripts"' + cols + "VALUES " + \
-                '(?,?,?,?,?,?,?,?)'
-    c.executemany(g_command,transcripts)
- 
-    update_counter = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
-    c.execute(update_counter, [counter, "transcripts"])
+    multi_insert(c, INSERT_TRANSCRIPT, transcripts)
 
     return
 
@@ -758,47 +752,34 @@ def bulk_update_transcript_annotations(c, bulk_annotations):
        Given a list of tuple-formatted transcript annotation entries, this 
        function inserts them into the database at the provided cursor (c).
     """
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["ID","annot_name",
-                   "source", "attribute", "value"]]) + ") "
-    command = 'INSERT INTO "transcript_annotations"' + cols + "VALUES " + \
-                  '(?,?,?,?,?)'
-    c.executemany(command, bulk_annotations)
+    multi_insert(c, INSERT_TRANSCRIPT_ANNOT, bulk_annotations)
 
     return
 
-def bulk_update_vertices(c, vertices):
+def bulk_update_exon_annotations(c, bulk_annotations):
     """
-       Given a list of tuple-formatted vertex entries, this
+       Given a list of tuple-formatted exon annotation entries, this
        function inserts them into the database at the provided cursor (c).
+       Exons shared between transcripts appear more than once, so only the
+       first entry for each attribute is kept.
     """
-    # Extract the counter
-    counter = vertices.pop("counter")
+    multi_insert(c, INSERT_EXON_ANNOT, bulk_annotations)
 
-    # Separate vertex entries and locations
-    vertex_list = []
-    location_list = []
-    for vertex in list(vertices.values()):
-        gene_IDs = list(vertex[-1])
-        vertex_list += [ (vertex[0], x) for x in gene_IDs ]
-        location_list.append(vertex[0:4])
- 
-    # Bulk entry of vertices
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["vertex_ID","gene_id"]]) + ") "
-    command = 'INSERT INTO "vertex"' + cols + "VALUES " + \
-                  '(?,?)'
+    return
 
-    c.executemany(command, vertex_list)
+def bulk_update_vertices(c, vertex_genes, locations):
+    """
+       Given a dict mapping vertex IDs to their gene IDs and a list of
+       tuple-formatted vertex locations, this function inserts them into the
+       database at the provided cursor (c).
+    """
+    # Bulk entry of vertices
+    multi_insert(c, INSERT_VERTEX, ((vertex_id, gene_id) for vertex_id, gene_IDs
+                                    in vertex_genes.items()
+                                    for gene_id in gene_IDs))
 
     # Bulk entry of locations
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["location_ID",
-                   "genome_build", "chromosome", "position"]]) + ") "
-    command = 'INSERT INTO "location"' + cols + "VALUES " + \
-                  '(?,?,?,?)'
-    c.executemany(command, location_list)
-
-    # Counter update
-    update_counter = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
-    c.execute(update_counter, [counter, "vertex"])
+    multi_insert(c, INSERT_LOCATION, locations)
 
     return
 
@@ -807,39 +788,29 @@ def bulk_update_edges(c, edges):
        Given a list of tuple-formatted edge entries, this
        function inserts them into the database at the provided cursor (c).
     """
-    # Extract the counter
-    counter = edges.pop("counter")
-
-    cols = " (" + ", ".join([str_wrap_double(x) for x in ["edge_ID","v1",
-                   "v2", "edge_type", "strand"]]) + ") "
-    command = 'INSERT INTO "edge"' + cols + "VALUES " + \
-                  '(?,?,?,?,?)'
-    c.executemany(command, edges.values())
-
-    update_counter = 'UPDATE "counters" SET "count" = ? WHERE "category" = ?'
-    c.execute(update_counter, [counter, "edge"])
+    multi_insert(c, INSERT_EDGE, edges)
 
     return
 
 def process_transcript(c, transcript, transcript_id, gene_id, genome_build, 
-                       annot_name, vertices, edges):
+                       annot_name, vertices, vertex_genes, locations, edges,
+                       edge_rows, counters, bulk_exon_annotations):
 
     exons = transcript.exons
     strand = transcript.strand
     transcript_vertices = []
     transcript_edges = []
 
-    for i in range(0, len(exons)):
-        exon = exons[i]
-        left = exon.start
-        right = exon.end
-        v1, vertices = create_vertex(c, gene_id, genome_build,
-                                     exon.chromosome, left, vertices)
-        transcript_vertices.append(v1)
+    # Bind the list appends once rather than on every exon
+    add_vertex = transcript_vertices.append
+    add_edge = transcript_edges.append
 
-        v2, vertices = create_vertex(c, gene_id, genome_build,
-                                     exon.chromosome, right, vertices)
-        transcript_vertices.append(v2)
+    for exon in exons:
+        chromosome = exon.chromosome
+        add_vertex(create_vertex(gene_id, genome_build, chromosome, exon.start,
+                                 vertices, vertex_genes, locations, counters))
+        add_vertex(create_vertex(gene_id, genome_build, chromosome, exon.end,
+                                 vertices, vertex_genes, locations, counters))
 
     # Iterate over vertices in order to create edges. If the transcript is on the
     # minus strand, reverse the vertex and edge lists
@@ -852,28 +823,22 @@ def process_transcript(c, transcript, transcript_id, gene_id, genome_build,
     end_vertex = transcript_vertices[-1]
     n_exons = len(exons)
 
-    prev_edge_type = None
-    exon_index = 0
-    for i in range(0,len(transcript_vertices) - 1):
-        vertex_1 = transcript_vertices[i]
-        vertex_2 = transcript_vertices[i+1]
+    # Consecutive vertices are joined by edges that alternate between exon
+    # and intron, starting with an exon
+    exon_iter = iter(exons)
+    for vertex_1, vertex_2, edge_type in zip(transcript_vertices,
+                                             transcript_vertices[1:],
+                                             cycle(("exon", "intron"))):
 
         # Try to create an edge between vertex 1 and 2
-        if prev_edge_type == None or prev_edge_type == "intron":
-            edge_type = "exon"
-
-        elif prev_edge_type == "exon":
-            edge_type = "intron"
-
-        edge_id, edges = create_edge(vertex_1, vertex_2, edge_type, strand, edges)
-        transcript_edges.append(edge_id)
+        edge_id = create_edge(vertex_1, vertex_2, edge_type, strand, edges,
+                              edge_rows, counters)
+        add_edge(edge_id)
 
         if edge_type == "exon":
-            # Add edge annotations to database
-            add_exon_annotations_to_db(c, exons[exon_index], edge_id, annot_name)
-            exon_index += 1
-
-        prev_edge_type = edge_type
+            # Queue edge annotations for the database
+            add_exon_annotations_to_db(next(exon_iter), edge_id, annot_name,
+                                       bulk_exon_annotations)
     if len(transcript_edges) > 1:
         transcript_path = ",".join(map(str,transcript_edges[1:-1]))
     else:
@@ -887,73 +852,66 @@ def process_transcript(c, transcript, transcript_id, gene_id, genome_build,
     return transcript_tuple
 
 
-def add_exon_annotations_to_db(c, exon, exon_id, annot_name):
-    """ Adds annotations from edge object to the database"""
+def add_exon_annotations_to_db(exon, exon_id, annot_name, bulk_annotations):
+    """ Adds annotations from edge object to the list of exon annotation
+        entries that are later inserted in bulk """
 
-    ignore = ["gene_id", "gene_name"]
     attributes = exon.annotations
     source = attributes['source']
     if "exon_status" not in attributes:
             attributes["exon_status"] = "KNOWN"
 
-    for att in attributes.keys():
-        if (att in ignore) or ("gene" in att) or ("transcript" in att):
-            continue
-        value = attributes[att]
-        cols = " (" + ", ".join([str_wrap_double(x) for x in ["ID","annot_name",
-               "source", "attribute", "value"]]) + ") "
-        vals = [exon_id, annot_name, source, att, value]
-
-        command = 'INSERT OR IGNORE INTO "exon_annotations"' + cols + "VALUES " + \
-                  '(?,?,?,?,?)'
-        c.execute(command,vals)
+    # Gene- and transcript-level attributes are stored elsewhere
+    bulk_annotations.extend((exon_id, annot_name, source, att, value)
+                            for att, value in attributes.items()
+                            if "gene" not in att and "transcript" not in att)
 
     return
             
-def create_edge(vertex_1, vertex_2, edge_type, strand, edges):
+def create_edge(vertex_1, vertex_2, edge_type, strand, edges, edge_rows,
+                counters):
     """  
        Creates a new edge with the provided information, unless a duplicate
-       already exists in the 'edges' dict.
+       already exists in the 'edges' dict. New edges are appended to
+       'edge_rows'. Returns the edge ID.
     """
     # Check if the edge exists, and return the ID if it does
-    query = ",".join([str(vertex_1), str(vertex_2), edge_type,strand])
-    if query in edges.keys():
-        existing_edge_id = edges[query][0]
-        return existing_edge_id, edges
+    query = (vertex_1, vertex_2, edge_type, strand)
+    existing_edge_id = edges.get(query)
+    if existing_edge_id is not None:
+        return existing_edge_id
 
     # In the case of no match, create the edge 
     # Get ID number from counter
-    edge_id = edges["counter"] + 1
-    edges["counter"] += 1
-    new_edge = (edge_id, vertex_1, vertex_2, edge_type, strand)
-    keyname = ",".join([str(vertex_1), str(vertex_2), edge_type, strand])
-    edges[keyname] = new_edge
+    counters.edge += 1
+    edge_id = counters.edge
+    edges[query] = edge_id
+    edge_rows.append((edge_id, vertex_1, vertex_2, edge_type, strand))
 
-    return edge_id, edges
+    return edge_id
 
-def create_vertex(c, gene_id, genome_build, chromosome, pos, vertices):
+def create_vertex(gene_id, genome_build, chromosome, pos, vertices,
+                  vertex_genes, locations, counters):
     """
        Creates a new vertex with the provided information, unless a duplicate 
-       already exists in the database.
+       already exists in the 'vertices' dict. Either way, the vertex is
+       associated with the current gene ID. Returns the vertex ID.
     """
-    # Check if the vertex exists. If yes, add current gene ID to it
-    query = ",".join([genome_build, chromosome, str(pos)])
-    if query in vertices.keys():
-        vertices[query][-1].add(gene_id)
-        existing_vertex_id = vertices[query][0]
-        return existing_vertex_id, vertices
+    # Check if the vertex exists, and create it if it does not. The
+    # 'vertices' dict is built per chromosome and genome build, so the
+    # position alone identifies the vertex
+    vertex_id = vertices.get(pos)
+    if vertex_id is None:
+        # Get ID number from counter
+        counters.vertex += 1
+        vertex_id = counters.vertex
+        vertices[pos] = vertex_id
+        vertex_genes[vertex_id] = set()
+        locations.append((vertex_id, genome_build, chromosome, pos))
 
-    # In the case of no match, create the edge
-    # Get ID number from counter
-    vertex_id = vertices["counter"] + 1
-    vertices["counter"] += 1
-    genes = set()
-    genes.add(gene_id)
-    new_vertex = [vertex_id, genome_build, chromosome, pos, genes]
-    keyname = ",".join([genome_build, chromosome, str(pos)])
-    vertices[keyname] = new_vertex
+    vertex_genes[vertex_id].add(gene_id)
 
-    return vertex_id, vertices
+    return vertex_id
 
 
 def str_wrap_double(s):
@@ -984,22 +942,28 @@ def main():
     db_name = outprefix + ".db"
     create_database(db_name)
 
-    # Initialize database tables
-    add_counter_table(db_name)
-    add_gene_table(db_name)
-    add_vertex_table(db_name)
-    add_edge_table(db_name)
-    add_transcript_table(db_name)
-    add_genome_table(db_name, genome_build)
-    add_location_table(db_name)
-    add_annotation_table(db_name, "gene_annotations", "genes", "gene_ID")
-    add_annotation_table(db_name, "transcript_annotations", "transcripts",
+    # Initialize database tables over a single connection and transaction.
+    # The transaction is managed explicitly rather than by the sqlite3 module
+    conn = sqlite3.connect(db_name, isolation_level = None)
+    c = conn.cursor()
+    c.execute("BEGIN")
+    add_counter_table(c)
+    add_gene_table(c)
+    add_vertex_table(c)
+    add_edge_table(c)
+    add_transcript_table(c)
+    add_genome_table(c, genome_build)
+    add_location_table(c)
+    add_annotation_table(c, "gene_annotations", "genes", "gene_ID")
+    add_annotation_table(c, "transcript_annotations", "transcripts",
                          "transcript_ID")
-    add_annotation_table(db_name, "exon_annotations", "exon", "ID")
-    add_dataset_table(db_name)
-    add_abundance_table(db_name)
-    add_observed_table(db_name)
-    init_run_info(db_name, idprefix, min_length, cutoff_5p, cutoff_3p)
+    add_annotation_table(c, "exon_annotations", "exon", "ID")
+    add_dataset_table(c)
+    add_abundance_table(c)
+    add_observed_table(c)
+    init_run_info(c, idprefix, min_length, cutoff_5p, cutoff_3p)
+    c.execute("COMMIT")
+    conn.close()
 
     # Read in genes, transcripts, and edges from GTF file
     genes, transcripts, exons = read_gtf_file(gtf_file)
@@ -1012,7 +976,11 @@ def main():
     chrom_genes, chrom_transcripts = organize_by_chromosome(genes, transcripts)
 
     # Populate the database tables
-    populate_db(db_name, annot_name, chrom_genes, chrom_transcripts, exons, genome_build)
+    populate_db(db_name, annot_name, chrom_genes, chrom_transcripts, exons,
+                genome_build, options.verbose)
+
+    # Index the populated tables
+    add_indexes(db_name)
 
 
 if __name__ == '__main__':
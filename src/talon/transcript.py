@@ -22,6 +22,8 @@ class Transcript(object):
            exons: List of exon objects belonging to this transcript, in sorted
            order.
     """
+    __slots__ = ("identifier", "gene_id", "chromosome", "start", "end",
+                 "strand", "n_exons", "exons", "introns", "annotations")
 
     def __init__(self, identifier, chromosome, start, end, strand, gene_id, 
                  annotations):
@@ -83,11 +85,8 @@ class Transcript(object):
         if len(self.exons) == 0:
             raise ValueError('Cannot compute length: Transcript does not ' + \
                              'have any exons')
-        
-        transcript_length = 0
-        for exon in self.exons:
-            transcript_length += exon.length
-        return transcript_length
+
+        return sum(exon.length for exon in self.exons)
 
     def get_exon_coords(self):
         """ Returns a list of the exon coordinates in order """
@@ -108,7 +107,7 @@ class Transcript(object):
         for i in range(0,len(self.exons)):
             existing_exon = self.exons[i]
             if exon.end < existing_exon.start:
-                self.exons = self.exons[0:i] + [exon] + self.exons[i:]
+                self.exons.insert(i, exon)
                 self.check_exon_validity()
                 self.n_exons += 1
                 return
@@ -259,7 +258,7 @@ def get_transcript_from_db(transcript_row, exon_tree, intron_tree):
     return transcript
     
 
-def get_transcript_from_gtf(transcript_info):
+def get_transcript_from_gtf(transcript_info, attributes = None):
     """ Uses information from a GTF-formatted transcript entry to create a
     Transcript object.
         Args:
@@ -283,7 +282,7 @@ def get_transcript_from_gtf(transcript_info):
 
     if "transcript_id" not in transcript_info[-1]:
             raise ValueError('GTF entry lacks a transcript_id field')
-    annotations = extract_transcript_annotations_from_GTF(transcript_info)
+    annotations = extract_transcript_annotations_from_GTF(transcript_info, attributes)
 
 
     gene_id = annotations['gene_id']
@@ -294,26 +293,28 @@ def get_transcript_from_gtf(transcript_info):
 
     return transcript
 
-def extract_transcript_annotations_from_GTF(tab_fields):
-    """ Extracts key-value annotations from the GTF description field
+def extract_transcript_annotations_from_GTF(tab_fields, attributes = None):
+    """ Extracts key-value annotations from the GTF description field, unless
+        they have already been parsed into an attribute dictionary
     """
 
-    attributes = {}
+    if attributes is None:
+        attributes = {}
 
-    # remove trailing newline and split by semicolon
-    description = tab_fields[-1].strip('\n')
-    description = description.split(';')
+        # remove trailing newline and split by semicolon
+        description = tab_fields[-1].strip('\n')
+        description = description.split(';')
 
-    # Parse description
-    for fields in description:
-        if fields == "" or fields == " ": continue
-        fields = fields.split()
-        if fields[0] == '': fields = fields[1:]
+        # Parse description
+        for fields in description:
+            if fields == "" or fields == " ": continue
+            fields = fields.split()
+            if fields[0] == '': fields = fields[1:]
 
-        key = fields[0].replace('"', '')
-        val = ' '.join(fields[1:]).replace('"', '')
+            key = fields[0].replace('"', '')
+            val = ' '.join(fields[1:]).replace('"', '')
 
-        attributes[key] = val
+            attributes[key] = val
 
     # Put in placeholders for important attributes (such as gene_id) if they
     # are absent
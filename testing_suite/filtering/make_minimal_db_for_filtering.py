@@ -66,15 +66,16 @@ def make_minimal_db_for_filtering(db_file, reads, datasets, annotations):
         os.system("rm %s" %(db_file))
 
     itd.create_database(db_file)
-    itd.add_dataset_table(db_file)
-    itd.add_observed_table(db_file)
-    itd.add_annotation_table(db_file, "transcript_annotations", "transcripts",
-                             "transcript_ID")
 
     conn = sqlite3.connect(db_file)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
+    itd.add_dataset_table(cursor)
+    itd.add_observed_table(cursor)
+    itd.add_annotation_table(cursor, "transcript_annotations", "transcripts",
+                             "transcript_ID")
+
     # Add reads to observed table
     cols = " (" + ", ".join([talon.str_wrap_double(x) for x in
                        ["obs_ID", "gene_ID", "transcript_ID", "read_name",